@@ -0,0 +1,214 @@
+# coding=utf-8
+"""
+Measures how fast the scrapers extract data from recorded responses. Every case feeds a response body from the
+fixtures directory through the complete extraction pipeline (decoding, prepare_response_content and all getters)
+without touching the network.
+
+    python benchmarks.py [--repeat N] [--save-baseline FILE] [--compare FILE] [--threshold FRACTION]
+
+With --compare, the exit code is 1 if a case got slower or needs more memory than the saved baseline allows.
+"""
+import argparse, json, os, sys, time, resource, copy
+import lxml.html
+
+from scraper import audiojelly, beatport
+from scraper.cache import build_response
+from scraper.replay import ReplayTransport
+
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+RELEASE_STAGES = ['get_response_content', 'prepare_response_content', 'get_release_date', 'get_release_format',
+                  'get_labels', 'get_catalog_numbers', 'get_release_title', 'get_release_artists', 'get_genres',
+                  'get_styles', 'get_release_country', 'get_disc_containers', 'get_disc_title', 'get_track_containers',
+                  'get_track_number', 'get_track_artists', 'get_track_title', 'get_track_length']
+
+SEARCH_STAGES = ['get_response_content', 'prepare_response_content', 'get_release_containers', 'get_release_name',
+                 'get_release_info', 'get_release_catalog', 'get_release_instance']
+
+COMPILATION_TRACKS = 120
+
+_transport = ReplayTransport(FIXTURES_DIRECTORY)
+
+
+def load_response(instance):
+    return _transport.load(instance.get_request_method(), instance.get_url(), instance.get_params(), instance.get_post_data())
+
+
+def beatport_compilation():
+    response = load_response(beatport.Release(851318))
+    parsed = json.loads(response.content)
+    tracks = parsed['results']['tracks']
+    parsed['results']['tracks'] = []
+    for i in range(COMPILATION_TRACKS):
+        track = copy.deepcopy(tracks[i % len(tracks)])
+        track['id'] += i
+        parsed['results']['tracks'].append(track)
+    return build_response(response.url, 200, response.headers, json.dumps(parsed), response.encoding)
+
+
+def audiojelly_compilation():
+    response = load_response(audiojelly.Release.release_from_url('http://www.audiojelly.com/releases/plus-various-i/230282'))
+    document = lxml.html.document_fromstring(response.content)
+    track_list = document.cssselect('div.trackList.release')[0]
+    rows = track_list.cssselect('div.trackListRow')
+    for i in range(len(rows), COMPILATION_TRACKS):
+        row = copy.deepcopy(rows[i % len(rows)])
+        row.cssselect('p.trackNum')[0].text = '%02d' % (i + 1)
+        track_list.append(row)
+    return build_response(response.url, 200, response.headers, lxml.html.tostring(document, encoding='utf-8'), response.encoding)
+
+
+class BenchmarkCase(object):
+
+    def __init__(self, name, factory, response=None):
+        self.name = name
+        self.factory = factory
+        self._response = response
+
+    def get_response(self):
+        if callable(self._response):
+            self._response = self._response()
+        elif self._response is None:
+            self._response = load_response(self.factory())
+        return self._response
+
+    def create(self):
+        instance = self.factory()
+        instance._cached_response = self.get_response()
+        return instance
+
+    def extract(self, instance):
+        if isinstance(instance, (beatport.Search, audiojelly.Search)):
+            return instance._extract_releases()
+        return instance._extract_infos()
+
+    def get_stages(self, instance):
+        if isinstance(instance, (beatport.Search, audiojelly.Search)):
+            return SEARCH_STAGES
+        return RELEASE_STAGES
+
+    def measure_rate(self, repeat):
+        self.get_response()
+        start = time.time()
+        for i in range(repeat):
+            self.extract(self.create())
+        return repeat / (time.time() - start)
+
+    def measure_stages(self, repeat):
+        timings = {}
+        for i in range(repeat):
+            instance = self.create()
+            for stage in self.get_stages(instance):
+                setattr(instance, stage, self._timed(getattr(instance, stage), stage, timings))
+            self.extract(instance)
+        return dict((stage, seconds / repeat) for stage, seconds in timings.iteritems())
+
+    def _timed(self, method, stage, timings):
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                timings[stage] = timings.get(stage, 0.0) + time.time() - start
+        return timed
+
+    def measure_peak_memory(self):
+        """
+        Returns the growth of the peak resident set size in KiB while extracting a single instance.
+        """
+        instance = self.create()
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.extract(instance)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+
+    def run(self, repeat):
+        """
+        Runs the case in a forked child, so that the peak memory of one case does not hide the one of the next.
+        """
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            try:
+                result = {
+                    'peak_memory_kb': self.measure_peak_memory(),
+                    'per_sec': self.measure_rate(repeat),
+                    'stages': self.measure_stages(repeat),
+                }
+                with os.fdopen(write_fd, 'w') as f:
+                    json.dump(result, f)
+            finally:
+                os._exit(0)
+        os.close(write_fd)
+        with os.fdopen(read_fd) as f:
+            output = f.read()
+        os.waitpid(pid, 0)
+        if not output:
+            raise RuntimeError(u'benchmark case %s failed' % self.name)
+        return json.loads(output)
+
+
+CASES = [
+    BenchmarkCase('beatport-single', lambda: beatport.Release(43577)),
+    BenchmarkCase('beatport-compilation', lambda: beatport.Release(851318), beatport_compilation),
+    BenchmarkCase('beatport-search', lambda: beatport.Search(u'love')),
+    BenchmarkCase('audiojelly-single', lambda: audiojelly.Release(211079, 'love-infinity-love-to-the-square-root-of-infinity')),
+    BenchmarkCase('audiojelly-compilation', lambda: audiojelly.Release(230282, 'plus-various-i'), audiojelly_compilation),
+    BenchmarkCase('audiojelly-search', lambda: audiojelly.Search(u'love')),
+]
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in sorted(results.iteritems()):
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        if result['per_sec'] < base['per_sec'] * (1 - threshold):
+            regressions.append(u'%s: %.1f/s, baseline %.1f/s' % (name, result['per_sec'], base['per_sec']))
+        # small growths of the peak memory are mostly noise of the allocator
+        if result['peak_memory_kb'] > max(base['peak_memory_kb'] * (1 + threshold), base['peak_memory_kb'] + 1024):
+            regressions.append(u'%s: peak memory %d KiB, baseline %d KiB' % (name, result['peak_memory_kb'], base['peak_memory_kb']))
+    return regressions
+
+
+def report(results, out):
+    for name, result in sorted(results.iteritems()):
+        out.write('%-24s %10.1f/s %10d KiB peak\n' % (name, result['per_sec'], result['peak_memory_kb']))
+        for stage, seconds in sorted(result['stages'].iteritems(), key=lambda x: -x[1]):
+            out.write('    %-28s %10.1f us\n' % (stage, seconds * 1000000))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=u'Benchmarks the extraction pipeline of the scrapers.')
+    parser.add_argument('--repeat', type=int, default=50, help=u'number of extractions per case')
+    parser.add_argument('--case', action='append', help=u'only run the given case (can be given multiple times)')
+    parser.add_argument('--save-baseline', metavar='FILE', help=u'save the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE', help=u'compare the results against a saved baseline')
+    parser.add_argument('--threshold', type=float, default=0.1, help=u'allowed relative regression (default: 0.1)')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for case in CASES:
+        if args.case and case.name not in args.case:
+            continue
+        results[case.name] = case.run(args.repeat)
+    report(results, sys.stdout)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            sys.stdout.write(u'REGRESSION %s\n' % regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,8 @@
 # coding=utf-8
 import lxml.html, re
 from base import BaseRelease, BaseSearch, BaseAPIError
+from htmlutils import select, parse_subtrees, element_matcher
+from pool import close_response
 
 
 READABLE_NAME = 'Audiojelly'
@@ -11,14 +13,96 @@ class AudiojellyAPIError(BaseAPIError):
     pass
 
 
-class Release(BaseRelease):
+class StreamingMixin(object):
+    """
+    In streaming mode the response is not read completely before it is parsed: get_response_content returns an
+    iterator over chunks of the body, which prepare_response_content can hand to parse_stream, so that reading stops
+    as soon as everything that is needed has been parsed.
+    """
+
+    streaming = False
+    stream_chunk_size = 16 * 1024
+
+    _stream_encoding = None
+
+    def get_request_kwargs(self):
+        kwargs = super(StreamingMixin, self).get_request_kwargs()
+        if self.streaming:
+            kwargs = dict(kwargs, prefetch=False)
+        return kwargs
+
+    def get_response_cache(self):
+        # a streamed response is never read completely, so it must not be shared
+        if self.streaming:
+            return None
+        return super(StreamingMixin, self).get_response_cache()
+
+    def get_disk_cache(self):
+        if self.streaming:
+            return None
+        return super(StreamingMixin, self).get_disk_cache()
+
+    def get_response_body_hash(self, response):
+        # reading the rest of a streamed body would defeat streaming, its data is cached without a hash
+        if self.streaming:
+            return None
+        return super(StreamingMixin, self).get_response_body_hash(response)
+
+    def _iter_content_chunks(self, content):
+        for i in range(0, len(content), self.stream_chunk_size):
+            yield content[i:i + self.stream_chunk_size]
+
+    def _iter_response_chunks(self, response):
+        if response._content is not False:
+            # the content has already been read, e.g. by a replayed response
+            chunks = self._iter_content_chunks(response.content)
+        else:
+            chunks = response.iter_content(self.stream_chunk_size)
+        deadline = self.get_deadline()
+        for chunk in chunks:
+            if deadline is not None:
+                deadline.check(u'reading the response')
+            yield chunk
+
+    def get_response_content(self, response):
+        if self.streaming:
+            self._stream_encoding = response.encoding
+            return self._iter_response_chunks(response)
+        return super(StreamingMixin, self).get_response_content(response)
+
+    def parse_stream(self, chunks, match, stop_after):
+        """
+        This method parses the chunks returned by get_response_content with parse_subtrees. The rest of the response is
+        given up afterwards, so that its connection is not kept open for the life of the instance.
+        """
+        try:
+            return parse_subtrees(chunks, match, stop_after, self._stream_encoding)
+        finally:
+            self.discard_stream(chunks)
+
+    def discard_stream(self, chunks):
+        """
+        This method gives up the rest of the response the chunks returned by get_response_content come from.
+        """
+        chunks.close()
+        if self._cached_response is not None:
+            close_response(self._cached_response)
+
+
+class Release(StreamingMixin, BaseRelease):
 
     _base_url = 'http://www.audiojelly.com/'
     url_regex = '^http://(?:www\.)?audiojelly\.com/releases/(.*?)/(\d+)$'
     exception = AudiojellyAPIError
+    extraction_modules = BaseRelease.extraction_modules + (__name__,)
 
     _various_artists_aliases = ['Various', 'Various Artists']
 
+    # In streaming mode the page is parsed while it is downloaded and only the parts the getters need are kept: the
+    # spec labels, the page header and the tracklist. Reading stops as soon as the tracklist is closed.
+    _stream_match = staticmethod(element_matcher('label', 'span.spec', 'div.pageHeader', 'div.trackList.release'))
+    _stream_stop_after = staticmethod(element_matcher('div.trackList.release'))
+
     def __init__(self, id, release_name):
         self.id = id
 
@@ -57,25 +141,15 @@ class Release(BaseRelease):
         return formatted_artists
 
     def prepare_response_content(self, content):
-        #get the raw response content and parse it
-        self.parsed_response = lxml.html.document_fromstring(content)
+        if self.streaming:
+            self.parsed_response = self.parse_stream(content, self._stream_match, self._stream_stop_after)
+        else:
+            #get the raw response content and parse it
+            self.parsed_response = lxml.html.document_fromstring(content)
 
-        self._label_dict = dict(map(lambda x: (x.getprevious().text_content().lower(), x),filter(lambda x: x.getprevious() is not None,self.parsed_response.cssselect('label + span.spec'))))
+        self._label_dict = dict(map(lambda x: (x.getprevious().text_content().lower(), x),filter(lambda x: x.getprevious() is not None,select(self.parsed_response, 'label + span.spec'))))
         self._track_artists_equal_release_artist = True
 
-        # check if the artists of each track equal the release artists
-        if self._label_dict.has_key('artist'):
-            release_artists = self._label_dict['artist'].text_content()
-            release_artists = self.remove_whitespace(release_artists)
-
-            track_artists = self.parsed_response.cssselect('span.artistName')
-            for track_artist_span in track_artists:
-                track_artist = track_artist_span.text_content()
-                track_artist = self.remove_whitespace(track_artist)
-                self._track_artists_equal_release_artist = track_artist == release_artists
-                if not self._track_artists_equal_release_artist:
-                    break
-
     def get_release_date(self):
         if self._label_dict.has_key('release date'):
             release_date = self._label_dict['release date'].text_content()
@@ -86,7 +160,7 @@ class Release(BaseRelease):
 
     def get_labels(self):
         if self._label_dict.has_key('label'):
-            label_anchors = self._label_dict['label'].cssselect('a')
+            label_anchors = select(self._label_dict['label'], 'a')
             labels = []
             for anchor in label_anchors:
                 link_text = anchor.text_content()
@@ -105,7 +179,7 @@ class Release(BaseRelease):
         return []
 
     def get_release_title(self):
-        title_h1 = self.parsed_response.cssselect('div.pageHeader h1')
+        title_h1 = select(self.parsed_response, 'div.pageHeader h1')
         if len(title_h1) == 1:
             title_h1 = title_h1[0]
             title = title_h1.text_content()
@@ -117,7 +191,7 @@ class Release(BaseRelease):
 
     def get_release_artists(self):
         if self._label_dict.has_key('artist'):
-            artist_anchors = self._label_dict['artist'].cssselect('a')
+            artist_anchors = select(self._label_dict['artist'], 'a')
             artists = []
             for anchor in artist_anchors:
                 artist = anchor.text_content()
@@ -133,7 +207,7 @@ class Release(BaseRelease):
 
     def get_genres(self):
         if self._label_dict.has_key('genre'):
-            genre_anchors = self._label_dict['genre'].cssselect('a')
+            genre_anchors = select(self._label_dict['genre'], 'a')
             genres = []
             for anchor in genre_anchors:
                 genre = anchor.text_content()
@@ -145,16 +219,55 @@ class Release(BaseRelease):
         return []
 
     def get_disc_containers(self):
-        release_tracklist = self.parsed_response.cssselect('div.trackList.release')
+        release_tracklist = select(self.parsed_response, 'div.trackList.release')
         if len(release_tracklist) != 1:
             self.raise_exception(u'could not get track list div')
         return {1 : release_tracklist[0]}
 
+    # the (tag, class) of the elements in a track row that contain the track fields
+    _track_row_fields = {
+        ('p', 'trackNum'): 'number',
+        ('span', 'artistName'): 'artists',
+        ('span', 'trackName'): 'title',
+        ('span', 'trackTime'): 'length',
+    }
+
+    def _walk_track_row(self, row):
+        """
+        This method collects the elements of all fields of the given track row in a single traversal.
+        """
+        container = {'number': [], 'artists': [], 'title': [], 'length': []}
+        for element in row.iterdescendants():
+            classes = element.get('class')
+            if classes and isinstance(element.tag, basestring):
+                for class_name in classes.split():
+                    field = self._track_row_fields.get((element.tag, class_name))
+                    if field is not None:
+                        container[field].append(element)
+        return container
+
     def get_track_containers(self, discContainer):
-        return discContainer.cssselect('div.trackListRow')
+        containers = map(self._walk_track_row, select(discContainer, 'div.trackListRow'))
+
+        # check if the artists of each track equal the release artists
+        if self._label_dict.has_key('artist'):
+            release_artists = self._label_dict['artist'].text_content()
+            release_artists = self.remove_whitespace(release_artists)
+
+            for container in containers:
+                for track_artist_span in container['artists']:
+                    track_artist = track_artist_span.text_content()
+                    track_artist = self.remove_whitespace(track_artist)
+                    self._track_artists_equal_release_artist = track_artist == release_artists
+                    if not self._track_artists_equal_release_artist:
+                        break
+                if not self._track_artists_equal_release_artist:
+                    break
+
+        return containers
 
     def get_track_number(self, trackContainer):
-        track_number = trackContainer.cssselect('p.trackNum')
+        track_number = trackContainer['number']
         if len(track_number) == 1:
             track_number = track_number[0].text_content()
             track_number = self.remove_whitespace(track_number)
@@ -167,10 +280,10 @@ class Release(BaseRelease):
 
     def get_track_artists(self, trackContainer):
         if not self._track_artists_equal_release_artist:
-            artist_span = trackContainer.cssselect('span.artistName')
+            artist_span = trackContainer['artists']
             if len(artist_span) == 1:
                 artists = []
-                artist_anchors = artist_span[0].cssselect('a')
+                artist_anchors = select(artist_span[0], 'a')
                 for anchor in artist_anchors:
                     artist = anchor.text_content()
                     artist = self.remove_whitespace(artist)
@@ -180,7 +293,7 @@ class Release(BaseRelease):
         return []
 
     def get_track_title(self, trackContainer):
-        title_span = trackContainer.cssselect('span.trackName')
+        title_span = trackContainer['title']
         if len(title_span) == 1:
             title = title_span[0].text_content()
             title = self.remove_whitespace(title)
@@ -189,7 +302,7 @@ class Release(BaseRelease):
         self.raise_exception(u'could not get track title')
 
     def get_track_length(self, trackContainer):
-        length_span = trackContainer.cssselect('span.trackTime')
+        length_span = trackContainer['length']
         if len(length_span) == 1:
             length = length_span[0].text_content()
             length = self.remove_whitespace(length)
@@ -198,19 +311,47 @@ class Release(BaseRelease):
         return None
 
 
-class Search(BaseSearch):
+class Search(StreamingMixin, BaseSearch):
 
     _base_url = 'http://www.audiojelly.com'
     url = _base_url + '/search/all/'
     exception = AudiojellyAPIError
 
+    page = 1
+    # the number of releases the site shows per page
+    results_per_page = 30
+    # the number of releases taken from the page, parsing stops once they are complete
+    max_results = 25
+
     _not_found = False
+    _result_count = 0
+
+    _release_info_fields = {
+        'relArtistName': 'artists',
+        'relReleaseName': 'title',
+        'relLabel': 'label',
+        'relGenre': 'genre',
+    }
 
     def __unicode__(self):
         return u'<AudiojellySearch: term="' + self.search_term + u'">'
 
     def get_params(self):
-        return {'view':'releases', 'q':self.search_term}
+        params = {'view':'releases', 'q':self.search_term}
+        if self.page > 1:
+            params['page'] = str(self.page)
+        return params
+
+    def get_page(self, page, page_size=None):
+        # the site decides the number of releases per page, so all of them are taken
+        search = self.__class__(self.search_term)
+        search.page = page
+        search.max_results = None
+        search.streaming = self.streaming
+        return search
+
+    def has_next_page(self):
+        return self._result_count >= self.results_per_page
 
     # Warning: The following is ugly hack territory. The stupid site apparently returns a 500 status code if it cannot
     # find at least one release with the given search term.
@@ -218,21 +359,68 @@ class Search(BaseSearch):
     def raise_exception(self, message):
         if message.startswith('500'):
             self._not_found = True
+            metrics = self.get_metrics()
+            if metrics is not None:
+                metrics.record_not_found(self.get_scraper_name(), self.metrics_operation)
         else:
             super(Search, self).raise_exception(message)
 
+    def _get_stop_after(self):
+        """
+        This method returns a stop_after function for parse_subtrees that stops after the last release that is needed
+        or after the search results if all of them are needed.
+        """
+        if self.max_results is None:
+            return element_matcher('div.searchResults')
+        is_release_info = element_matcher('div.relInfo')
+        seen = [0]
+
+        def stop_after(tag, attrib):
+            if is_release_info(tag, attrib):
+                seen[0] += 1
+                return seen[0] >= self.max_results
+            return False
+        return stop_after
+
     def prepare_response_content(self, content):
-        if not self._not_found:
+        if self._not_found:
+            if self.streaming:
+                # the error page is not needed
+                self.discard_stream(content)
+            return
+        if self.streaming:
+            self.parsed_response = self.parse_stream(content, element_matcher('div.relInfo'), self._get_stop_after())
+        else:
             #get the raw response content and parse it
             self.parsed_response = lxml.html.document_fromstring(content)
 
+    def _walk_release_info(self, release_info):
+        """
+        This method collects the anchors and divs of all fields of the given relInfo block in a single traversal.
+        """
+        container = {'artists': [], 'title': [], 'label': [], 'genre': []}
+        for element in release_info.iterdescendants('div'):
+            for class_name in element.get('class', '').split():
+                field = self._release_info_fields.get(class_name)
+                if field is None:
+                    continue
+                if field in ('artists', 'title'):
+                    container[field].extend(element.iterdescendants('a'))
+                else:
+                    container[field].append(element)
+        return container
+
     def get_release_containers(self):
         if self._not_found:
             return []
-        return self.parsed_response.cssselect('div.relInfo')[:25]
+        release_infos = select(self.parsed_response, 'div.relInfo')
+        self._result_count = len(release_infos)
+        if self.max_results is not None:
+            release_infos = release_infos[:self.max_results]
+        return map(self._walk_release_info, release_infos)
 
     def get_release_name(self,releaseContainer):
-        release_artist_anchor = releaseContainer.cssselect('div.relArtistName a')
+        release_artist_anchor = releaseContainer['artists']
         if len(release_artist_anchor) == 0:
             self.raise_exception(u'could not extract release artist')
         artists = []
@@ -241,7 +429,7 @@ class Search(BaseSearch):
             artist = self.remove_whitespace(artist)
             if artist:
                 artists.append(artist)
-        release_title_anchor = releaseContainer.cssselect('div.relReleaseName a')
+        release_title_anchor = releaseContainer['title']
         if len(release_title_anchor) != 1:
             self.raise_exception(u'could not get release name anchor')
         release_title = release_title_anchor[0].text_content()
@@ -250,13 +438,13 @@ class Search(BaseSearch):
 
     def get_release_info(self,releaseContainer):
         components = []
-        label_div = releaseContainer.cssselect('div.relLabel')
+        label_div = releaseContainer['label']
         if len(label_div) == 1:
             label = label_div[0].text_content()
             label = self.remove_whitespace(label)
             if label:
                 components.append(label)
-        genre_div = releaseContainer.cssselect('div.relGenre')
+        genre_div = releaseContainer['genre']
         if len(genre_div) == 1:
             genre = genre_div[0].text_content()
             genre = self.remove_whitespace(genre)
@@ -267,8 +455,8 @@ class Search(BaseSearch):
         return None
 
     def get_release_instance(self,releaseContainer):
-        release_title_anchor = releaseContainer.cssselect('div.relReleaseName a')
+        release_title_anchor = releaseContainer['title']
         if len(release_title_anchor) != 1:
             self.raise_exception(u'could not get release name anchor')
         release_url = self._base_url + release_title_anchor[0].attrib['href']
-        return Release.release_from_url(release_url)
\ No newline at end of file
+        return Release.release_from_url(release_url)
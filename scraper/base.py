@@ -1,4 +1,14 @@
-import requests, re, logging
+import requests, re, logging, urlparse, Queue, time, sys, hashlib, threading, contextlib
+import htmlutils, model
+from pool import default_connection_pool
+from cache import default_response_cache, make_cache_key
+from ratelimit import default_rate_limiter, parse_retry_after, RateLimitTimeout
+from deadline import DeadlineExceeded
+from hedging import default_hedge_policy
+from engine import get_default_engine
+from model import CompactRelease
+from metrics import default_metrics
+from datacache import hash_body
 
 
 class BaseAPIError(Exception):
@@ -20,6 +30,10 @@ class StatusCodeError(requests.RequestException):
     pass
 
 
+# the deadlines given to single calls of get_data and get_releases, by thread and instance
+_call_deadlines = threading.local()
+
+
 class RequestMixin(object):
     REQUEST_METHOD_POST = 'post'
     REQUEST_METHOD_GET = 'get'
@@ -31,6 +45,17 @@ class RequestMixin(object):
     post_data = None
     request_kwargs = {}
     forced_response_encoding = None
+    connection_pool = default_connection_pool
+    response_cache = default_response_cache
+    response_cache_ttl = None
+    disk_cache = None
+    transport = None
+    rate_limiter = default_rate_limiter
+    throttle_retries = 2
+    hedge_policy = default_hedge_policy
+    deadline = None
+    metrics = default_metrics
+    metrics_operation = 'request'
 
     _cached_response = None
 
@@ -39,18 +64,139 @@ class RequestMixin(object):
         The internal method that makes the actual request and returns a response object. This should normally not be used
         directly.
         """
-        if method == self.REQUEST_METHOD_POST:
-            r = requests.post(url=url, data=post_data, params=params, headers=headers, **kwargs)
+        metrics = self.get_metrics()
+        start = time.time()
+        try:
+            transport = self.get_transport()
+            if transport is not None:
+                r = transport.request(self._send_request, method=method, url=url, params=params, headers=headers, post_data=post_data, kwargs=kwargs)
+            else:
+                r = self._send_request(method=method, url=url, params=params, headers=headers, post_data=post_data, kwargs=kwargs)
+        except Exception:
+            if metrics is not None:
+                metrics.record_request(self.get_scraper_name(), self.metrics_operation, 'error', time.time() - start)
+            raise
+        if metrics is not None:
+            if r._content_consumed:
+                size = len(r.content or '')
+            else:
+                # a streamed response that has not been read yet
+                size = int(r.headers.get('content-length') or 0)
+            metrics.record_request(self.get_scraper_name(), self.metrics_operation, r.status_code, time.time() - start, size)
+        return r
+
+    def _send_request(self, method, url, params, headers, post_data, kwargs):
+        """
+        The internal method that sends the request over the network.
+        """
+        # resolved here, the hedged attempts run in other threads
+        deadline = self.get_deadline()
+        return self._send_paced(method=method, url=url, params=params, headers=headers, post_data=post_data, kwargs=kwargs, deadline=deadline)
+
+    def _send_paced(self, method, url, params, headers, post_data, kwargs, deadline=None):
+        """
+        The internal method that sends a request and retries it up to throttle_retries times while the host throttles
+        it. The rate limiter makes the retries wait for the time a Retry-After header asked for.
+        """
+        rate_limiter = self.get_rate_limiter()
+        host_limiter = rate_limiter.get(urlparse.urlsplit(url).netloc.lower()) if rate_limiter is not None else None
+        attempt = 0
+        while True:
+            r = self._send(method=method, url=url, params=params, headers=headers, post_data=post_data, kwargs=kwargs, deadline=deadline, host_limiter=host_limiter)
+            if host_limiter is None or r.status_code not in host_limiter.THROTTLE_STATUS_CODES or attempt >= self.get_throttle_retries():
+                return r
+            attempt += 1
+
+    def _pace(self, host_limiter, deadline, blocking=True):
+        """
+        The internal method that takes a request slot from the rate limiter of the host. It waits for one until the
+        deadline passes and then raises DeadlineExceeded, or, if blocking is False, returns False if no slot is free.
+        """
+        if host_limiter is None:
+            return True
+        if not blocking:
+            timeout = 0
         else:
-            r = requests.get(url=url, params=params, headers=headers, **kwargs)
+            timeout = deadline.remaining() if deadline is not None else None
+        try:
+            host_limiter.acquire(timeout)
+        except RateLimitTimeout:
+            if not blocking:
+                return False
+            raise DeadlineExceeded(u'deadline of %s seconds exceeded while waiting for the rate limiter' % deadline.seconds)
+        return True
+
+    def _send(self, method, url, params, headers, post_data, kwargs, deadline=None, host_limiter=None):
+        """
+        The internal method that sends a request. GET requests are hedged and retried as the hedge policy says, POST
+        requests are sent once. Every single request, hedges and retries included, takes a slot from the rate limiter
+        of the host and reports its outcome to it.
+        """
+        if deadline is None:
+            deadline = self.get_deadline()
+        hedge_policy = self.get_hedge_policy()
+        pace = lambda blocking=True: self._pace(host_limiter, deadline, blocking)
+        if hedge_policy is None or method != self.REQUEST_METHOD_GET:
+            pace()
+            return self._send_once(method, url, params, headers, post_data, kwargs, deadline, host_limiter)
+        if hedge_policy.timeout is not None and 'timeout' not in kwargs:
+            kwargs = dict(kwargs, timeout=hedge_policy.timeout)
+        return hedge_policy.send(lambda: self._send_once(method, url, params, headers, post_data, kwargs, deadline, host_limiter),
+                                 urlparse.urlsplit(url).netloc.lower(), deadline=deadline, pace=pace)
+
+    def _send_once(self, method, url, params, headers, post_data, kwargs, deadline, host_limiter=None):
+        """
+        The internal method that sends a single request with the session of the connection pool. The connect and read
+        timeouts are limited to the remaining time of the deadline, and a timeout caused by the deadline raises
+        DeadlineExceeded. The status code and the latency are reported to the rate limiter of the host.
+        """
+        limited_by_deadline = False
+        if deadline is not None:
+            deadline.check(u'sending the request')
+            timeout = deadline.get_timeout(kwargs.get('timeout'))
+            limited_by_deadline = timeout != kwargs.get('timeout')
+            kwargs = dict(kwargs, timeout=timeout)
+        connection_pool = self.get_connection_pool()
+        if connection_pool is not None:
+            session = connection_pool.get_session(url)
+        else:
+            session = requests
+        start = time.time()
+        try:
+            if method == self.REQUEST_METHOD_POST:
+                r = session.post(url=url, data=post_data, params=params, headers=headers, **kwargs)
+            else:
+                r = session.get(url=url, params=params, headers=headers, **kwargs)
+        except requests.Timeout:
+            if limited_by_deadline:
+                raise DeadlineExceeded(u'deadline of %s seconds exceeded while waiting for the response' % deadline.seconds)
+            raise
+        if host_limiter is not None:
+            host_limiter.record(r.status_code, time.time() - start, parse_retry_after(r.headers.get('retry-after')))
         return r
 
     def raise_request_exception(self, message):
         raise StatusCodeError(message)
 
+    def _record_parse(self, seconds):
+        metrics = self.get_metrics()
+        if metrics is not None:
+            metrics.record_parse(self.get_scraper_name(), self.metrics_operation, seconds)
+
+    def _record_exception(self, exception):
+        metrics = self.get_metrics()
+        if metrics is not None:
+            metrics.record_exception(self.get_scraper_name(), self.metrics_operation, exception)
+
     def get_url(self):
         return self.url
 
+    def get_request_host(self):
+        """
+        This method returns the host the request is sent to.
+        """
+        return urlparse.urlsplit(self.get_url()).netloc.lower()
+
     def get_params(self):
         return self.params
 
@@ -69,14 +215,143 @@ class RequestMixin(object):
     def get_forced_response_encoding(self):
         return self.forced_response_encoding
 
+    def get_connection_pool(self):
+        """
+        This method returns the ConnectionPool the requests are sent through or None if every request should open its
+        own connection.
+        """
+        return self.connection_pool
+
+    def get_response_cache(self):
+        """
+        This method returns the ResponseCache that is shared with other instances or None if responses should not be
+        shared.
+        """
+        return self.response_cache
+
+    def get_response_cache_ttl(self):
+        """
+        This method returns the number of seconds a response stays in the shared cache or None for the cache default.
+        """
+        return self.response_cache_ttl
+
+    def get_rate_limiter(self):
+        """
+        This method returns the RateLimiter that paces the requests to each host or None.
+        """
+        return self.rate_limiter
+
+    def get_throttle_retries(self):
+        return self.throttle_retries
+
+    def get_hedge_policy(self):
+        """
+        This method returns the HedgePolicy GET requests are sent with or None if they should be sent only once.
+        """
+        return self.hedge_policy
+
+    def get_deadline(self):
+        """
+        This method returns the Deadline fetching and parsing have to be finished by or None. A deadline given to the
+        current call of get_data or get_releases takes precedence over the deadline attribute.
+        """
+        deadline = getattr(_call_deadlines, 'deadlines', {}).get(id(self))
+        if deadline is not None:
+            return deadline
+        return self.deadline
+
+    @contextlib.contextmanager
+    def deadline_scope(self, deadline):
+        """
+        This method returns a context manager that applies the given Deadline to this instance, but only in the
+        current thread and only until the block is left.
+        """
+        if deadline is None:
+            yield
+            return
+        deadlines = _call_deadlines.__dict__.setdefault('deadlines', {})
+        previous = deadlines.get(id(self))
+        deadlines[id(self)] = deadline
+        try:
+            yield
+        finally:
+            if previous is None:
+                del deadlines[id(self)]
+            else:
+                deadlines[id(self)] = previous
+
+    def get_metrics(self):
+        """
+        This method returns the ScraperMetrics requests, parsing and exceptions are recorded in or None.
+        """
+        return self.metrics
+
+    def get_scraper_name(self):
+        """
+        This method returns the name of the scraper module the instance belongs to.
+        """
+        return self.__module__.rpartition('.')[2]
+
+    def get_transport(self):
+        """
+        This method returns the transport (e.g. a ReplayTransport) requests are handed to or None if they should be sent
+        to the network directly.
+        """
+        return self.transport
+
+    def get_disk_cache(self):
+        """
+        This method returns the DiskCache responses are persisted in or None.
+        """
+        return self.disk_cache
+
+    def get_cache_key(self):
+        return make_cache_key(self.get_request_method(), self.get_url(), self.get_params(), self.get_post_data())
+
     def get_response_content(self, response):
         return response.text
 
+    def _fetch_response(self, cache_key):
+        """
+        This method returns the response from the disk cache if there is a fresh entry. Otherwise the request is made,
+        conditionally if a stale entry can be revalidated, and the result is stored in the disk cache.
+        """
+        headers = self.get_headers()
+        disk_cache = self.get_disk_cache()
+        entry = None
+        if disk_cache is not None:
+            max_age = self.get_response_cache_ttl()
+            if max_age is None:
+                max_age = disk_cache.max_age
+            entry = disk_cache.get(cache_key)
+            if entry is not None:
+                if entry.is_fresh(max_age):
+                    return entry.response
+                headers = dict(headers)
+                headers.update(entry.get_validators())
+
+        response = self._make_request(method=self.get_request_method(), url=self.get_url(), params=self.get_params(), headers=headers, post_data=self.get_post_data(), kwargs=self.get_request_kwargs())
+
+        if disk_cache is not None:
+            if response.status_code == 304 and entry is not None:
+                disk_cache.refresh(entry, response)
+                return entry.response
+            if response.status_code == 200:
+                disk_cache.set(cache_key, response)
+        return response
+
     def get_response(self):
         if self._cached_response is None:
-            self._cached_response = self._make_request(method=self.get_request_method(), url=self.get_url(), params=self.get_params(), headers=self.get_headers(), post_data=self.get_post_data(), kwargs=self.get_request_kwargs())
-            if self._cached_response.status_code != 200:
-                self.raise_request_exception('%d' % (self._cached_response.status_code if self._cached_response.status_code else 500)) #make sure we don't crash
+            response_cache = self.get_response_cache()
+            cache_key = self.get_cache_key()
+            if response_cache is not None:
+                self._cached_response = response_cache.get(cache_key)
+            if self._cached_response is None:
+                self._cached_response = self._fetch_response(cache_key)
+                if self._cached_response.status_code != 200:
+                    self.raise_request_exception('%d' % (self._cached_response.status_code if self._cached_response.status_code else 500)) #make sure we don't crash
+                elif response_cache is not None:
+                    response_cache.set(cache_key, self._cached_response, self.get_response_cache_ttl())
             forced_encoding = self.get_forced_response_encoding()
             if forced_encoding:
                 self._cached_response.encoding = forced_encoding
@@ -126,8 +401,97 @@ class LoggerMixin(object):
         logger = self.get_logger()
         logger.log(level, msg, extra=self.get_extra_log_kwargs())
 
+    def record_span(self, name, seconds, tags):
+        """
+        This method is the default sink of InstrumentationMixin, it logs every span at DEBUG level.
+        """
+        if self.get_logger().isEnabledFor(self.DEBUG):
+            tag_string = u' '.join(u'%s=%s' % (key, value) for key, value in sorted(tags.iteritems()))
+            self.log(self.DEBUG, u'span %s took %.3f ms [%s]' % (name, seconds * 1000, tag_string))
+
+
+class InstrumentationMixin(object):
+    """
+    Reports the time spent in the phases of a lookup as spans: 'fetch' (getting the response), 'decode'
+    (get_response_content), 'prepare' (prepare_response_content) and one span per getter. Getters that are called once
+    per track or search result are reported as a single span with the total time and a 'count' tag.
+
+    Spans are reported to the record_span(name, seconds, tags) method of the span sink, which is the instance itself
+    (see LoggerMixin.record_span) unless span_sink is set. Without instrument, only a flag is checked per phase.
+    """
 
-class BaseRelease(ExceptionMixin, RequestMixin, UtilityMixin, LoggerMixin):
+    instrument = False
+    span_sink = None
+
+    def get_span_sink(self):
+        """
+        This method returns the object the spans are reported to or None if the instance is not instrumented.
+        """
+        if not self.instrument:
+            return None
+        if self.span_sink is not None:
+            return self.span_sink
+        return self
+
+    def get_span_tags(self):
+        """
+        This method returns the tags every span of this instance is reported with.
+        """
+        return {'scraper': self.get_scraper_name()}
+
+    def _record_span(self, sink, name, seconds, **tags):
+        span_tags = self.get_span_tags()
+        span_tags.update(tags)
+        sink.record_span(name, seconds, span_tags)
+
+    def _timed(self, sink, name, method, *args):
+        if sink is None:
+            return method(*args)
+        start = time.time()
+        try:
+            return method(*args)
+        finally:
+            self._record_span(sink, name, time.time() - start)
+
+    def _aggregated(self, name, method, totals):
+        """
+        This method returns a wrapper of method that adds the time of every call to totals[name].
+        """
+        def aggregated(*args):
+            start = time.time()
+            try:
+                return method(*args)
+            finally:
+                total = totals.setdefault(name, [0.0, 0])
+                total[0] += time.time() - start
+                total[1] += 1
+        return aggregated
+
+    def _record_aggregated_spans(self, sink, totals):
+        for name, (seconds, count) in sorted(totals.iteritems()):
+            self._record_span(sink, name, seconds, count=count)
+
+
+def _read_module_code(module):
+    """
+    This function returns the source of the given module, its compiled code if there is no source, or None.
+    """
+    path = getattr(module, '__file__', None)
+    if path is None:
+        return None
+    paths = [path]
+    if path.endswith(('.pyc', '.pyo')):
+        paths.insert(0, path[:-1])
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except IOError:
+            pass
+    return None
+
+
+class BaseRelease(ExceptionMixin, RequestMixin, UtilityMixin, LoggerMixin, InstrumentationMixin):
     ARTIST_TYPE_MAIN = 'Main'
     ARTIST_TYPE_FEATURE = 'Feature'
     ARTIST_TYPE_REMIXER = 'Remixer'
@@ -135,10 +499,34 @@ class BaseRelease(ExceptionMixin, RequestMixin, UtilityMixin, LoggerMixin):
 
     url_regex = ''
 
+    # the getter of each field of the data dictionary that is not part of the tracklist
+    field_getters = {
+        'released': 'get_release_date',
+        'format': 'get_release_format',
+        'label': 'get_labels',
+        'catalog': 'get_catalog_numbers',
+        'title': 'get_release_title',
+        'artists': 'get_release_artists',
+        'genre': 'get_genres',
+        'style': 'get_styles',
+        'country': 'get_release_country',
+    }
+    TRACKLIST_FIELDS = ('discs', 'discTitles')
+    # all fields of the data dictionary in the order _extract_infos extracts them
+    FIELDS = ('released', 'format', 'label', 'catalog', 'title', 'artists', 'genre', 'style', 'country', 'link') + TRACKLIST_FIELDS
+
     _data = None
     _release_url = None
+    _prepared = False
+    _field_values = None
 
     priority = 10
+    metrics_operation = 'release'
+    data_cache = None
+    # entries of the data cache are only used by the same version, None derives it from the source of the modules
+    scraper_version = None
+    # the modules whose code shapes the extracted data, every scraper adds its own module
+    extraction_modules = (__name__, htmlutils.__name__, model.__name__)
 
     def raise_request_exception(self, message):
         """
@@ -149,9 +537,43 @@ class BaseRelease(ExceptionMixin, RequestMixin, UtilityMixin, LoggerMixin):
     @property
     def data(self):
         if self._data is None:
-            self._data = self._extract_infos()
+            data = self._extract_cached_infos()
+            if data.get('partial'):
+                # the missing fields are extracted on the next access
+                return data
+            self._data = data
         return self._data
 
+    def get_data(self, deadline=None):
+        """
+        This method returns data, extracted within the given Deadline (or the one of the instance). Fields that could
+        not be extracted in time are left out and the 'partial' key of the returned dictionary is set to True. The
+        deadline only applies to this call.
+        """
+        with self.deadline_scope(deadline):
+            return self.data
+
+    def get_span_tags(self):
+        tags = super(BaseRelease, self).get_span_tags()
+        tags['release'] = getattr(self, 'id', None)
+        return tags
+
+    def get_compact_data(self):
+        """
+        This method returns the data of the release as a CompactRelease, which needs a lot less memory than the data
+        dictionary. Its to_data method returns the data dictionary again.
+        """
+        return CompactRelease.from_data(self.data)
+
+    def fetch_data(self, engine=None):
+        """
+        This method fetches and extracts the release data on the given FetchEngine (or the default one) and returns a
+        Future for it, so that many releases can be resolved concurrently.
+        """
+        if engine is None:
+            engine = get_default_engine()
+        return engine.submit(self.get_request_host(), lambda: self.data)
+
     @property
     def release_url(self):
         if self._release_url is not None:
@@ -274,97 +696,226 @@ class BaseRelease(ExceptionMixin, RequestMixin, UtilityMixin, LoggerMixin):
         """
         return None
 
-    def _extract_infos(self):
-        data = {}
-
-        response = self.get_response()
-
-        self.prepare_response_content(self.get_response_content(response))
-
-        releaseDate = self.get_release_date()
-        if releaseDate:
-            data['released'] = releaseDate
-
-        releaseFormat = self.get_release_format()
-        if releaseFormat:
-            data['format'] = releaseFormat
+    def _prepare(self):
+        """
+        This method fetches the response and hands its content to prepare_response_content, once per instance.
+        """
+        if not self._prepared:
+            sink = self.get_span_sink()
+            response = self._timed(sink, 'fetch', self.get_response)
+
+            start = time.time()
+            self._timed(sink, 'prepare', self.prepare_response_content, self._timed(sink, 'decode', self.get_response_content, response))
+            self._record_parse(time.time() - start)
+            self._prepared = True
+
+    def _extract_discs(self):
+        deadline = self.get_deadline()
+        sink = self.get_span_sink()
+        get_disc_title = self.get_disc_title
+        get_track_containers = self.get_track_containers
+        get_track_number = self.get_track_number
+        get_track_artists = self.get_track_artists
+        get_track_title = self.get_track_title
+        get_track_length = self.get_track_length
+        if sink is not None:
+            totals = {}
+            get_disc_title = self._aggregated('get_disc_title', get_disc_title, totals)
+            get_track_containers = self._aggregated('get_track_containers', get_track_containers, totals)
+            get_track_number = self._aggregated('get_track_number', get_track_number, totals)
+            get_track_artists = self._aggregated('get_track_artists', get_track_artists, totals)
+            get_track_title = self._aggregated('get_track_title', get_track_title, totals)
+            get_track_length = self._aggregated('get_track_length', get_track_length, totals)
+
+        discContainers = self._timed(sink, 'get_disc_containers', self.get_disc_containers)
+        discs = {}
+        discTitles = {}
+        for discIndex in discContainers:
+            discs[discIndex] = []
 
-        labels = self.get_labels()
-        if labels:
-            data['label'] = labels
+            discTitle = get_disc_title(discContainers[discIndex])
+            if discTitle:
+                discTitles[discIndex] = discTitle
 
-        catalogNumbers = self.get_catalog_numbers()
-        if catalogNumbers:
-            data['catalog'] = catalogNumbers
+            trackContainers = get_track_containers(discContainers[discIndex])
 
-        releaseTitle = self.get_release_title()
-        if releaseTitle:
-            data['title'] = releaseTitle
+            for trackContainer in trackContainers:
+                if deadline is not None:
+                    deadline.check(u'extracting the tracklist')
+                trackNumber = get_track_number(trackContainer)
+                trackArtists = get_track_artists(trackContainer)
+                trackTitle = get_track_title(trackContainer)
+                trackLength = get_track_length(trackContainer)
 
-        releaseArtists = self.get_release_artists()
-        if releaseArtists:
-            data['artists'] = releaseArtists
+                discs[discIndex].append((trackNumber, trackArtists, trackTitle, trackLength))
 
-        genres = self.get_genres()
-        if genres:
-            data['genre'] = genres
+        if sink is not None:
+            self._record_aggregated_spans(sink, totals)
+        return discs, discTitles
+
+    def _extract_field(self, field):
+        if field == 'link':
+            self._field_values['link'] = self.release_url
+        elif field in self.TRACKLIST_FIELDS:
+            self._prepare()
+            self._field_values['discs'], self._field_values['discTitles'] = self._extract_discs()
+        elif field in self.field_getters:
+            self._prepare()
+            getter = self.field_getters[field]
+            self._field_values[field] = self._timed(self.get_span_sink(), getter, getattr(self, getter))
+        else:
+            raise ValueError(u'unknown field: %s' % field)
 
-        styles = self.get_styles()
-        if styles:
-            data['style'] = styles
+    def get_fields(self, fields):
+        """
+        This method returns a dictionary like data, but only with the given fields. Only the getters needed for these
+        fields are run and every field is extracted only once per instance. The tracklist ('discs' and 'discTitles')
+        is only extracted if one of its fields is requested.
 
-        releaseCountry = self.get_release_country()
-        if releaseCountry:
-            data['country'] = releaseCountry
+        Once the deadline has passed, the remaining fields are left out and 'partial' is set to True.
+        """
+        if self._field_values is None:
+            self._field_values = {}
+        deadline = self.get_deadline()
+        data = {}
+        for field in fields:
+            if field not in self._field_values:
+                if deadline is not None and deadline.expired():
+                    data['partial'] = True
+                    continue
+                try:
+                    self._extract_field(field)
+                except DeadlineExceeded:
+                    data['partial'] = True
+                    continue
+                except Exception as e:
+                    self._record_exception(e)
+                    raise
+            value = self._field_values[field]
+            if value:
+                data[field] = value
+        return data
 
-        releaseUrl = self.release_url
-        if releaseUrl:
-            data['link'] = releaseUrl
+    def _extract_infos(self):
+        return self.get_fields(self.FIELDS)
 
-        discContainers = self.get_disc_containers()
-        discs = {}
-        discTitles = {}
-        for discIndex in discContainers:
-            discs[discIndex] = []
+    def get_data_cache(self):
+        """
+        This method returns the DataCache extracted data is stored in or None. Without a scraper version there is no
+        data cache.
+        """
+        if self.data_cache is None or self.get_scraper_version() is None:
+            return None
+        return self.data_cache
 
-            discTitle = self.get_disc_title(discContainers[discIndex])
-            if discTitle:
-                discTitles[discIndex] = discTitle
+    def get_data_cache_key(self):
+        return (self.get_scraper_name(), self.get_cache_key())
 
-            trackContainers = self.get_track_containers(discContainers[discIndex])
+    def get_extraction_modules(self):
+        return self.extraction_modules
 
-            for trackContainer in trackContainers:
-                trackNumber = self.get_track_number(trackContainer)
-                trackArtists = self.get_track_artists(trackContainer)
-                trackTitle = self.get_track_title(trackContainer)
-                trackLength = self.get_track_length(trackContainer)
+    def get_scraper_version(self):
+        """
+        This method returns scraper_version or, if it is None, a hash of the code of the extraction modules of the
+        class (see get_extraction_modules). The hash of a module is computed from its source or, if that is missing,
+        from its compiled file. It is computed only once per class and is None if a module cannot be read.
+        """
+        if self.scraper_version is not None:
+            return self.scraper_version
+        cls = self.__class__
+        if '_source_version' not in cls.__dict__:
+            version = hashlib.sha1()
+            for name in self.get_extraction_modules():
+                code = _read_module_code(sys.modules.get(name))
+                if code is None:
+                    version = None
+                    break
+                version.update(name)
+                version.update(code)
+            cls._source_version = version.hexdigest()[:12] if version is not None else None
+        return cls._source_version
+
+    def get_response_body_hash(self, response):
+        """
+        This method returns the SHA-1 of the body of the response or None if it cannot be read completely.
+        """
+        return hash_body(response.content)
 
-                discs[discIndex].append((trackNumber, trackArtists, trackTitle, trackLength))
-        if discs:
-            data['discs'] = discs
-        if discTitles:
-            data['discTitles'] = discTitles
+    def get_cached_data(self):
+        """
+        This method returns the data from the data cache if there is a fresh entry for the current scraper version or
+        None. A stale entry is returned as well if the body of the response has not changed since.
+        """
+        data_cache = self.get_data_cache()
+        if data_cache is None:
+            return None
+        key = self.get_data_cache_key()
+        entry = data_cache.get(key, self.get_scraper_version())
+        if entry is None:
+            return None
+        if entry.is_fresh(data_cache.max_age):
+            return entry.data
+        if entry.body_hash is None or self._prepared:
+            return None
+        body_hash = self.get_response_body_hash(self.get_response())
+        if body_hash != entry.body_hash:
+            return None
+        data_cache.refresh(key, entry)
+        return entry.data
 
+    def set_cached_data(self, data):
+        """
+        This method stores complete data in the data cache, with the hash of the body it was extracted from.
+        """
+        data_cache = self.get_data_cache()
+        if data_cache is None or data.get('partial'):
+            return
+        body_hash = None
+        if self._cached_response is not None:
+            body_hash = self.get_response_body_hash(self._cached_response)
+        data_cache.set(self.get_data_cache_key(), self.get_scraper_version(), data, body_hash)
+
+    def _extract_cached_infos(self):
+        data = self.get_cached_data()
+        if data is None:
+            data = self._extract_infos()
+            self.set_cached_data(data)
         return data
 
     @staticmethod
     def _get_args_from_match(match):
         return match.groups()
 
+    @classmethod
+    def get_url_pattern(cls):
+        """
+        This method returns the compiled url_regex of the class. It is compiled only once per class.
+        """
+        if '_url_pattern' not in cls.__dict__:
+            cls._url_pattern = re.compile(cls.url_regex)
+        return cls._url_pattern
+
+    @classmethod
+    def release_from_match(cls, match, url):
+        release = cls(*cls._get_args_from_match(match))
+        release._release_url = url
+        return release
+
     @classmethod
     def release_from_url(cls, url):
-        m = re.match(cls.url_regex,url)
+        m = cls.get_url_pattern().match(url)
         if m:
-            release = cls(*cls._get_args_from_match(m))
-            release._release_url = url
-            return release
+            return cls.release_from_match(m, url)
         else:
             return None
 
 
-class BaseSearch(ExceptionMixin, RequestMixin, UtilityMixin, LoggerMixin):
+class BaseSearch(ExceptionMixin, RequestMixin, UtilityMixin, LoggerMixin, InstrumentationMixin):
     _releases = None
 
+    partial = False
+    metrics_operation = 'search'
+
     def raise_request_exception(self, message):
         """
         Make sure the RequestMixin uses ExceptionMixin
@@ -381,9 +932,127 @@ class BaseSearch(ExceptionMixin, RequestMixin, UtilityMixin, LoggerMixin):
     @property
     def releases(self):
         if self._releases is None:
-            self._releases = self._extract_releases()
+            try:
+                releases = self._extract_releases()
+            except Exception as e:
+                self._record_exception(e)
+                raise
+            if self.partial:
+                return releases
+            self._releases = releases
         return self._releases
 
+    def get_span_tags(self):
+        tags = super(BaseSearch, self).get_span_tags()
+        tags['search_term'] = self.search_term
+        return tags
+
+    def get_releases(self, deadline=None):
+        """
+        This method returns releases, extracted within the given Deadline (or the one of the instance). If the deadline
+        passes, the releases found until then are returned and partial is set to True. The deadline only applies to
+        this call.
+        """
+        with self.deadline_scope(deadline):
+            return self.releases
+
+    def fetch_releases(self, engine=None):
+        """
+        This method runs the search on the given FetchEngine (or the default one) and returns a Future for the list of
+        releases.
+        """
+        if engine is None:
+            engine = get_default_engine()
+        return engine.submit(self.get_request_host(), lambda: self.releases)
+
+    def get_page(self, page, page_size=None):
+        """
+        This method should return a search for the given page of the results, with page_size (or the default number
+        of) results per page, or None if the scraper cannot page through the results.
+        """
+        return None
+
+    def has_next_page(self):
+        """
+        This method should return True if there are more results after the page of this search. It is only called
+        after the releases have been extracted.
+        """
+        return False
+
+    def iter_releases(self, page_size=None, max_results=None, engine=None):
+        """
+        This generator yields the entries of the releases lists of all pages of the results, up to max_results
+        entries. The next page is fetched on the given FetchEngine (or the default one) while the entries of the
+        current page are consumed, and no further pages are fetched once the caller stops iterating. Scrapers that
+        cannot page only yield the releases of this search.
+
+        The pages share the deadline of this search. Once a page is partial, no further pages are fetched.
+        """
+        if engine is None:
+            engine = get_default_engine()
+
+        deadline = self.get_deadline()
+        page = 1
+        search = self.get_page(page, page_size)
+        if search is None:
+            search = self
+        else:
+            search.deadline = deadline
+        future = search.fetch_releases(engine)
+        count = 0
+        while future is not None:
+            releases = future.result()
+            next_future = None
+            if search is not self and not search.partial and search.has_next_page() and (max_results is None or count + len(releases) < max_results):
+                page += 1
+                search = self.get_page(page, page_size)
+                search.deadline = deadline
+                next_future = search.fetch_releases(engine)
+
+            for release in releases:
+                if max_results is not None and count >= max_results:
+                    return
+                yield release
+                count += 1
+            if not releases:
+                return
+            future = next_future
+
+    def iter_hydrated_releases(self, max_workers=8, engine=None):
+        """
+        This generator fetches the data of all found releases concurrently, with at most max_workers fetches in flight,
+        and yields each entry of the releases list as soon as the data of its release is available. Releases whose data
+        cannot be fetched are logged and skipped.
+        """
+        if engine is None:
+            engine = get_default_engine()
+
+        remaining = iter(self.releases)
+        finished = Queue.Queue()
+
+        def submit_next():
+            for release in remaining:
+                future = release['release'].fetch_data(engine)
+                future.add_done_callback(lambda future, release=release: finished.put((release, future)))
+                return True
+            return False
+
+        in_flight = 0
+        while in_flight < max_workers and submit_next():
+            in_flight += 1
+
+        while in_flight:
+            release, future = finished.get()
+            in_flight -= 1
+            if submit_next():
+                in_flight += 1
+
+            exception = future.exception()
+            if exception is not None:
+                self.log(self.WARNING, u'could not fetch data of %s: %s' % (unicode(release['release']), exception))
+                continue
+            yield release
+
     def prepare_response_content(self, content):
         """
         This method is called before any other parsing method with the raw content of the response.
@@ -409,6 +1078,12 @@ class BaseSearch(ExceptionMixin, RequestMixin, UtilityMixin, LoggerMixin):
         """
         return None
 
+    def get_release_catalog(self,releaseContainer):
+        """
+        This method should return the catalog number of the release as a string or None.
+        """
+        return None
+
     def get_release_instance(self,releaseContainer):
         """
         This method should return the release instance or None. If this method returns None, the release described by
@@ -418,19 +1093,45 @@ class BaseSearch(ExceptionMixin, RequestMixin, UtilityMixin, LoggerMixin):
 
     def _extract_releases(self):
         releases = []
-
-        response = self.get_response()
-
-        self.prepare_response_content(self.get_response_content(response))
-
-        releaseContainers = self.get_release_containers()
+        deadline = self.get_deadline()
+        sink = self.get_span_sink()
+        self.partial = False
+
+        try:
+            response = self._timed(sink, 'fetch', self.get_response)
+
+            start = time.time()
+            self._timed(sink, 'prepare', self.prepare_response_content, self._timed(sink, 'decode', self.get_response_content, response))
+            self._record_parse(time.time() - start)
+        except DeadlineExceeded:
+            self.partial = True
+            return releases
+
+        get_release_name = self.get_release_name
+        get_release_info = self.get_release_info
+        get_release_catalog = self.get_release_catalog
+        get_release_instance = self.get_release_instance
+        if sink is not None:
+            totals = {}
+            get_release_name = self._aggregated('get_release_name', get_release_name, totals)
+            get_release_info = self._aggregated('get_release_info', get_release_info, totals)
+            get_release_catalog = self._aggregated('get_release_catalog', get_release_catalog, totals)
+            get_release_instance = self._aggregated('get_release_instance', get_release_instance, totals)
+
+        releaseContainers = self._timed(sink, 'get_release_containers', self.get_release_containers)
         for releaseContainer in releaseContainers:
-            releaseName = self.get_release_name(releaseContainer)
-            releaseInfo = self.get_release_info(releaseContainer)
-            releaseInstance = self.get_release_instance(releaseContainer)
+            if deadline is not None and deadline.expired():
+                self.partial = True
+                break
+            releaseName = get_release_name(releaseContainer)
+            releaseInfo = get_release_info(releaseContainer)
+            releaseCatalog = get_release_catalog(releaseContainer)
+            releaseInstance = get_release_instance(releaseContainer)
 
             # we only add releases to the result list that we can actually access
             if releaseInstance is not None:
-                releases.append({'name':releaseName,'info':releaseInfo,'release':releaseInstance})
+                releases.append({'name':releaseName,'info':releaseInfo,'catalog':releaseCatalog,'release':releaseInstance})
 
+        if sink is not None:
+            self._record_aggregated_spans(sink, totals)
         return releases
\ No newline at end of file
@@ -1,6 +1,7 @@
 # coding=utf-8
 import json
-from base import BaseRelease, BaseSearch, BaseAPIError
+from base import BaseRelease, BaseSearch, BaseAPIError, ExceptionMixin, RequestMixin, LoggerMixin
+from engine import get_default_engine, in_engine_worker
 
 
 READABLE_NAME = 'Beatport'
@@ -16,6 +17,9 @@ class Release(BaseRelease):
     url = 'http://api.beatport.com/catalog/releases/detail'
     url_regex = '^http://(?:www\.)?beatport\.com/release/(.*?)/(\d+)$'
     exception = BeatportAPIError
+    extraction_modules = BaseRelease.extraction_modules + (__name__,)
+
+    artists = None
 
     def __init__(self, id, release_name=''):
         self.id = id
@@ -31,6 +35,16 @@ class Release(BaseRelease):
             return (int(match.group(2)), )
         return (int(match.group(2)), match.group(1))
 
+    @classmethod
+    def from_result(cls, result):
+        """
+        This method creates a release from an entry of the results of the API, without making another request.
+        """
+        release = cls(result['id'], result.get('slug', ''))
+        release.parsed_response = result
+        release._prepared = True
+        return release
+
     def get_params(self):
         return {'format':'json','v':'1.0','id':self.id}
 
@@ -114,6 +128,9 @@ class Release(BaseRelease):
     def get_track_artists(self, trackContainer):
         track = trackContainer['track']
         if track.has_key('artists'):
+            if self.artists is None:
+                # the release artists are needed for the comparison below, even if only the tracklist was requested
+                self.get_release_artists()
             track_main_artists = []
             track_additional_artists = []
             for track_artist_candidate in track['artists']:
@@ -146,13 +163,94 @@ class Release(BaseRelease):
         return None
 
 
+class ReleaseBatch(ExceptionMixin, RequestMixin, LoggerMixin):
+    """
+    Fetches the details of several releases with a single request.
+    """
+
+    url = 'http://api.beatport.com/catalog/releases'
+    exception = BeatportAPIError
+
+    chunk_size = 10
+    metrics_operation = 'batch'
+
+    def __init__(self, ids):
+        self.ids = ids
+
+    def __unicode__(self):
+        return u'<BeatportReleaseBatch: ids=%s>' % u','.join(map(unicode, self.ids))
+
+    def raise_request_exception(self, message):
+        self.raise_exception(message)
+
+    def get_params(self):
+        return {'format':'json','v':'1.0','ids':','.join(map(str, self.ids)),'perPage':len(self.ids)}
+
+    def get_results(self):
+        """
+        This method returns a dictionary with the result of every release of the batch that the API returned with its
+        tracklist, keyed by id.
+        """
+        try:
+            response = json.loads(self.get_response_content(self.get_response()))
+            results = response['results']
+        except (ValueError, KeyError, TypeError):
+            self.raise_exception(u'invalid server response')
+        return dict((result['id'], result) for result in results if 'id' in result and 'tracks' in result)
+
+    @classmethod
+    def resolve(cls, ids, chunk_size=None, engine=None):
+        """
+        This method returns a Release for each of the given ids, in the same order. The ids are fetched in batches of
+        chunk_size on the given FetchEngine (or the default one) and the releases have their data already filled in.
+        Releases that are missing from a batch (or whose batch failed) are returned without data, so they fall back to
+        a request of their own when their data is accessed.
+
+        Called on a worker thread of an engine, the batches are fetched one after the other in that thread instead,
+        because waiting for other calls there could deadlock.
+        """
+        if chunk_size is None:
+            chunk_size = cls.chunk_size
+        ids = [int(id) for id in ids]
+        batches = [cls(ids[i:i + chunk_size]) for i in range(0, len(ids), chunk_size)]
+        if in_engine_worker():
+            futures = [None] * len(batches)
+        else:
+            if engine is None:
+                engine = get_default_engine()
+            futures = [engine.submit(batch.get_request_host(), batch.get_results) for batch in batches]
+
+        results = {}
+        for batch, future in zip(batches, futures):
+            try:
+                results.update(batch.get_results() if future is None else future.result())
+            except Exception as e:
+                batch.log(batch.WARNING, u'could not fetch batch, falling back to single requests: %s' % e)
+        return [Release.from_result(results[id]) if id in results else Release(id) for id in ids]
+
+
 class Search(BaseSearch):
 
     url = 'http://api.beatport.com/catalog/search'
     exception = BeatportAPIError
 
+    page = 1
+    per_page = 25
+
     def get_params(self):
-        return {'v':'2.0','format':'json','perPage':'25','page':'1','facets':['fieldType:release',], 'highlight':'false', 'query':self.search_term}
+        return {'v':'2.0','format':'json','perPage':str(self.per_page),'page':str(self.page),'facets':['fieldType:release',], 'highlight':'false', 'query':self.search_term}
+
+    def get_page(self, page, page_size=None):
+        search = self.__class__(self.search_term)
+        search.page = page
+        search.per_page = page_size or self.per_page
+        return search
+
+    def has_next_page(self):
+        metadata = self.parsed_response.get('metadata', {})
+        if 'totalPages' in metadata:
+            return self.page < metadata['totalPages']
+        return len(self.parsed_response.get('results', [])) >= self.per_page
 
     def prepare_response_content(self, content):
         try:
@@ -197,6 +295,9 @@ class Search(BaseSearch):
         info = u' | '.join(add_info)
         return info
 
+    def get_release_catalog(self, releaseContainer):
+        return releaseContainer.get('catalogNumber')
+
     def get_release_instance(self, releaseContainer):
         id = releaseContainer['id']
         if releaseContainer.has_key('slug'):
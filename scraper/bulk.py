@@ -0,0 +1,201 @@
+# coding=utf-8
+"""
+Resolves many release URLs (or search terms) concurrently and writes one JSON line per result.
+
+    python -m scraper.bulk [FILE] [--search] [--workers N] [--per-host N] [--max-results N] [--processes N]
+                           [--output FILE] [--checkpoint FILE]
+
+The input is read line by line from FILE or stdin; empty lines and lines starting with '#' are skipped. Every result
+is written as soon as it is complete, so the output is not in input order:
+
+    {"index": 0, "input": "http://...", "ok": true, "data": {...}}
+    {"index": 1, "input": "http://...", "ok": false, "error": {"type": "BeatportAPIError", "message": "..."}}
+
+With --processes, the responses are still fetched by the worker threads, but the releases are parsed in a pool of
+processes (see ProcessExtractor), so that parsing can use more than one core.
+
+With --search, every line is a search term that is run on all scrapers (see FederatedSearch) and "releases" holds
+the found releases instead of "data".
+
+Only a bounded number of inputs are read ahead of the workers. With --checkpoint, the index of every finished input
+is appended to the given file, and inputs listed there are skipped when the same input is processed again, so an
+interrupted run can be resumed with the same arguments (use --output with append mode, which is the default for
+files). A summary is written to stderr at the end.
+"""
+from __future__ import absolute_import
+import argparse, json, os, sys, time, Queue
+
+from scraper.engine import FetchEngine
+from scraper.offload import ProcessExtractor
+from scraper.federated import FederatedSearch
+from scraper.registry import get_default_registry
+
+
+class UnsupportedURL(Exception):
+    """No scraper handles the URL"""
+    pass
+
+
+def read_inputs(lines):
+    """
+    This generator yields the index and the text of every input line.
+    """
+    index = 0
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        yield index, line.decode('utf-8')
+        index += 1
+
+
+def read_checkpoint(path):
+    """
+    This function returns the set of input indexes listed in the given checkpoint file.
+    """
+    done = set()
+    if path is None or not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line.isdigit():
+                done.add(int(line))
+    return done
+
+
+def serialize_release_entry(entry):
+    release = entry['release']
+    return {
+        'name': entry['name'],
+        'info': entry['info'],
+        'catalog': entry.get('catalog'),
+        'source': entry.get('source'),
+        'url': release.release_url if release is not None else None,
+    }
+
+
+class BulkResolver(object):
+    """
+    Resolves inputs on a FetchEngine, with at most max_in_flight inputs submitted at a time.
+    """
+
+    def __init__(self, registry=None, workers=8, per_host_limit=None, search=False, max_results=25, processes=0):
+        self.registry = registry or get_default_registry()
+        # started first, the worker processes must not be forked from a process that already runs threads
+        self.extractor = ProcessExtractor(processes) if processes else None
+        self.engine = FetchEngine(max_workers=workers, per_host_limit=per_host_limit or workers)
+        self.max_in_flight = workers * 2
+        self.search = search
+        self.max_results = max_results
+
+    def resolve_release(self, url, release):
+        if release is None:
+            raise UnsupportedURL(u'no scraper handles %s' % url)
+        if self.extractor is not None:
+            return {'data': self.extractor.extract(release)}
+        return {'data': release.data}
+
+    def resolve_search(self, term):
+        search = FederatedSearch(term, registry=self.registry, max_results=self.max_results)
+        result = {'releases': map(serialize_release_entry, search.releases)}
+        if search.timed_out or search.errors:
+            result['incomplete'] = sorted(search.timed_out + search.errors.keys())
+        return result
+
+    def submit(self, index, text, finished):
+        if self.search:
+            future = self.engine.submit('search', self.resolve_search, text)
+        else:
+            # the release found here is the one that is resolved, the URL is only matched once
+            release = self.registry.release_from_url(text)
+            host = release.get_request_host() if release is not None else None
+            future = self.engine.submit(host, self.resolve_release, text, release)
+        future.add_done_callback(lambda future: finished.put((index, text, future)))
+
+    def iter_results(self, inputs):
+        """
+        This generator yields a result dictionary for every (index, text) of inputs as soon as it is finished.
+        """
+        inputs = iter(inputs)
+        finished = Queue.Queue()
+        in_flight = 0
+        exhausted = False
+        while True:
+            while not exhausted and in_flight < self.max_in_flight:
+                try:
+                    index, text = next(inputs)
+                except StopIteration:
+                    exhausted = True
+                    break
+                self.submit(index, text, finished)
+                in_flight += 1
+            if not in_flight:
+                return
+
+            index, text, future = finished.get()
+            in_flight -= 1
+            result = {'index': index, 'input': text}
+            exception = future.exception()
+            if exception is None:
+                result['ok'] = True
+                result.update(future.result())
+            else:
+                result['ok'] = False
+                result['error'] = {'type': exception.__class__.__name__, 'message': unicode(exception)}
+            yield result
+
+    def close(self):
+        """
+        This method stops the worker threads of the engine and the worker processes of the extractor.
+        """
+        self.engine.shutdown()
+        if self.extractor is not None:
+            self.extractor.close()
+
+
+def main(argv=None, stdin=sys.stdin, stdout=sys.stdout, stderr=sys.stderr):
+    parser = argparse.ArgumentParser(prog='python -m scraper.bulk', description=u'Resolves release URLs or search terms and writes JSON lines.')
+    parser.add_argument('input', nargs='?', help=u'file with one URL or search term per line (default: stdin)')
+    parser.add_argument('--search', action='store_true', help=u'the lines are search terms instead of release URLs')
+    parser.add_argument('--workers', type=int, default=8, help=u'number of concurrent workers (default: 8)')
+    parser.add_argument('--per-host', type=int, help=u'maximum concurrent requests per host (default: --workers)')
+    parser.add_argument('--max-results', type=int, default=25, help=u'maximum releases per scraper and search term (default: 25)')
+    parser.add_argument('--processes', type=int, default=0, help=u'parse releases in a pool of the given number of processes (default: parse in the worker threads)')
+    parser.add_argument('--output', help=u'append the results to the given file instead of writing them to stdout')
+    parser.add_argument('--checkpoint', help=u'record finished inputs in the given file and skip them when resuming')
+    args = parser.parse_args(argv)
+
+    done = read_checkpoint(args.checkpoint)
+    input_file = open(args.input) if args.input else stdin
+    output = open(args.output, 'a') if args.output else stdout
+    checkpoint = open(args.checkpoint, 'a') if args.checkpoint else None
+
+    # BulkResolver creates the process pool before its FetchEngine starts any threads, nothing must start one before
+    resolver = BulkResolver(workers=args.workers, per_host_limit=args.per_host, search=args.search, max_results=args.max_results,
+                            processes=args.processes)
+    inputs = ((index, text) for index, text in read_inputs(input_file) if index not in done)
+    counts = {True: 0, False: 0}
+    start = time.time()
+    try:
+        for result in resolver.iter_results(inputs):
+            output.write(json.dumps(result, sort_keys=True) + '\n')
+            output.flush()
+            if checkpoint is not None:
+                checkpoint.write('%d\n' % result['index'])
+                checkpoint.flush()
+            counts[result['ok']] += 1
+    finally:
+        elapsed = time.time() - start
+        total = counts[True] + counts[False]
+        stderr.write(u'%d resolved, %d failed, %d skipped in %.1f s (%.1f/s)\n'
+                     % (counts[True], counts[False], len(done), elapsed, total / elapsed if elapsed else 0.0))
+        for f in (input_file, output, checkpoint):
+            if f is not None and f not in (stdin, stdout):
+                f.close()
+        resolver.close()
+    return 1 if counts[False] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
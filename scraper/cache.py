@@ -0,0 +1,132 @@
+import threading, time, collections, json, hashlib
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.iteritems()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def make_cache_key(method, url, params, post_data):
+    """
+    This function returns a hashable key that identifies a request by its method, URL, parameters and post data,
+    independent of the order of the parameters.
+    """
+    return (method, url, _freeze(params), _freeze(post_data))
+
+
+def hash_cache_key(cache_key):
+    """
+    This function returns a stable hex digest of a key created by make_cache_key, e.g. to use it as a file name.
+    """
+    return hashlib.sha1(json.dumps(cache_key, sort_keys=True)).hexdigest()
+
+
+def build_response(url, status_code, headers, content, encoding):
+    """
+    This function creates a requests Response from stored data, without touching the network.
+    """
+    response = Response()
+    response.url = url
+    response.status_code = status_code
+    response.headers = CaseInsensitiveDict(headers)
+    response.encoding = encoding
+    response._content = content
+    response._content_consumed = True
+    return response
+
+
+def lru_get(entries, key):
+    """
+    This function returns the value of the given key of an OrderedDict used as an LRU or None and marks the entry as
+    the most recently used one.
+    """
+    value = entries.pop(key, None)
+    if value is not None:
+        # re-insert to mark the entry as most recently used
+        entries[key] = value
+    return value
+
+
+def lru_set(entries, key, value, maxsize):
+    """
+    This function stores the value of the given key in an OrderedDict used as an LRU, removes the least recently used
+    entries beyond maxsize and returns how many were removed.
+    """
+    entries.pop(key, None)
+    entries[key] = value
+    evicted = 0
+    while len(entries) > maxsize:
+        entries.popitem(last=False)
+        evicted += 1
+    return evicted
+
+
+class ResponseCache(object):
+    """
+    A thread-safe, size-bounded LRU cache for responses that is shared by all Release and Search instances. Entries
+    expire after a time-to-live that can be set per entry.
+    """
+
+    def __init__(self, maxsize=256, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def get(self, key):
+        """
+        This method returns the cached response for the given key or None.
+        """
+        with self._lock:
+            entry = lru_get(self._entries, key)
+            if entry is None:
+                self._misses += 1
+                return None
+            expires, response = entry
+            if expires is not None and expires <= time.time():
+                del self._entries[key]
+                self._expirations += 1
+                self._misses += 1
+                return None
+            self._hits += 1
+            return response
+
+    def set(self, key, response, ttl=None):
+        """
+        This method stores the response under the given key. If ttl is None, the default time-to-live of the cache is
+        used, a ttl of 0 means the response is not cached at all.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        if ttl == 0 or self.maxsize <= 0:
+            return
+        expires = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._evictions += lru_set(self._entries, key, (expires, response), self.maxsize)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+            }
+
+
+default_response_cache = ResponseCache()
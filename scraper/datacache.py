@@ -0,0 +1,177 @@
+import os, time, hashlib, threading, collections, cPickle
+from cache import hash_cache_key, lru_get, lru_set
+from diskcache import ensure_directory, write_atomically
+
+
+class DataCacheEntry(object):
+    """
+    The extracted data of a release together with the scraper version that extracted it and the SHA-1 of the response
+    body it was extracted from (None if the body was not read completely, e.g. when streaming).
+    """
+
+    def __init__(self, data, version, body_hash, stored):
+        self.data = data
+        self.version = version
+        self.body_hash = body_hash
+        self.stored = stored
+
+    def is_fresh(self, max_age):
+        return max_age is None or self.stored + max_age > time.time()
+
+
+class MemoryDataBackend(object):
+    """
+    A thread-safe LRU of at most maxsize pickled entries.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.evictions = 0
+
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key_hash):
+        with self._lock:
+            return lru_get(self._entries, key_hash)
+
+    def set(self, key_hash, value):
+        with self._lock:
+            self.evictions += lru_set(self._entries, key_hash, value, self.maxsize)
+
+    def delete(self, key_hash):
+        with self._lock:
+            self._entries.pop(key_hash, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskDataBackend(object):
+    """
+    Stores every pickled entry in its own file of the given directory, written atomically, so the cache can be shared
+    by several processes and survives restarts.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.evictions = 0
+        ensure_directory(directory)
+
+    def _path(self, key_hash):
+        return os.path.join(self.directory, key_hash + '.pickle')
+
+    def get(self, key_hash):
+        try:
+            with open(self._path(key_hash), 'rb') as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def set(self, key_hash, value):
+        write_atomically(self._path(key_hash), value)
+
+    def delete(self, key_hash):
+        try:
+            os.remove(self._path(key_hash))
+        except OSError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.pickle'):
+                self.delete(name[:-len('.pickle')])
+
+    def __len__(self):
+        return len([name for name in os.listdir(self.directory) if name.endswith('.pickle')])
+
+
+class DataCache(object):
+    """
+    A cache of the data dictionaries extracted from releases, so that a hit skips fetching, decoding and parsing the
+    response completely. Keys are the request keys of the releases (see make_cache_key), prefixed with the name of
+    the scraper.
+
+    An entry is only returned for the scraper version it was stored with, so a change to the code of one scraper
+    invalidates only the entries of that scraper. Entries older than max_age seconds (None: never) are revalidated:
+    the response is fetched again and if its body still has the same SHA-1, the stored data is returned without
+    parsing it again.
+
+    The entries are pickled, so every hit returns a fresh copy of the data. backend is a MemoryDataBackend (the
+    default) or a DiskDataBackend, or any object with their get, set, delete and clear methods.
+    """
+
+    def __init__(self, backend=None, max_age=24 * 3600):
+        if backend is None:
+            backend = MemoryDataBackend()
+        self.backend = backend
+        self.max_age = max_age
+
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(('hits', 'misses', 'stale', 'revalidations', 'invalidations', 'stores', 'errors'), 0)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get(self, key, version):
+        """
+        This method returns the DataCacheEntry stored for the given key by the given scraper version or None. The
+        entry might be stale, use is_fresh to check. Entries of other versions are removed.
+        """
+        key_hash = hash_cache_key(key)
+        value = self.backend.get(key_hash)
+        if value is None:
+            self._count('misses')
+            return None
+        try:
+            entry = cPickle.loads(value)
+        except Exception:
+            # a truncated file or an entry written by an incompatible version of this module
+            self._count('errors')
+            self._count('misses')
+            self.backend.delete(key_hash)
+            return None
+        if entry.version != version:
+            self._count('invalidations')
+            self._count('misses')
+            self.backend.delete(key_hash)
+            return None
+        if entry.is_fresh(self.max_age):
+            self._count('hits')
+        else:
+            self._count('stale')
+        return entry
+
+    def set(self, key, version, data, body_hash):
+        """
+        This method stores the data extracted by the given scraper version from a body with the given SHA-1.
+        """
+        entry = DataCacheEntry(data, version, body_hash, time.time())
+        self.backend.set(hash_cache_key(key), cPickle.dumps(entry, cPickle.HIGHEST_PROTOCOL))
+        self._count('stores')
+
+    def refresh(self, key, entry):
+        """
+        This method marks the given entry as fresh again after the response body turned out to be unchanged.
+        """
+        self.set(key, entry.version, entry.data, entry.body_hash)
+        self._count('revalidations')
+
+    def clear(self):
+        self.backend.clear()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['size'] = len(self.backend)
+        stats['evictions'] = self.backend.evictions
+        return stats
+
+
+def hash_body(content):
+    return hashlib.sha1(content or '').hexdigest()
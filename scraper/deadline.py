@@ -0,0 +1,40 @@
+import time
+import requests
+
+
+class DeadlineExceeded(requests.RequestException):
+    """The time budget for fetching and parsing ran out"""
+    pass
+
+
+class Deadline(object):
+    """
+    A time budget of the given number of seconds for fetching and parsing a release or search, starting when the
+    Deadline is created. The same Deadline can be shared by several instances that have to finish together.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires = time.time() + seconds
+
+    def remaining(self):
+        return max(self.expires - time.time(), 0.0)
+
+    def expired(self):
+        return time.time() >= self.expires
+
+    def check(self, stage):
+        """
+        This method raises DeadlineExceeded if the deadline has passed. stage names what was about to be done.
+        """
+        if self.expired():
+            raise DeadlineExceeded(u'deadline of %s seconds exceeded before %s' % (self.seconds, stage))
+
+    def get_timeout(self, timeout=None):
+        """
+        This method returns the given timeout, but at most the remaining time.
+        """
+        remaining = self.remaining()
+        if timeout is None:
+            return remaining
+        return min(timeout, remaining)
@@ -0,0 +1,208 @@
+import os, time, json, zlib, hashlib, tempfile, fcntl, errno
+from cache import hash_cache_key, build_response
+
+
+def ensure_directory(path):
+    """
+    This function creates the given directory and its parents unless it exists.
+    """
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError as e:
+            # another process might have created it in the meantime
+            if e.errno != errno.EEXIST:
+                raise
+
+
+def write_atomically(path, data):
+    """
+    This function writes data to a temporary file next to the given path and renames it, so that other processes never
+    read a partially written file.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(temp_path, path)
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class DiskCacheEntry(object):
+    """
+    A response stored in a DiskCache together with the metadata needed to revalidate it.
+    """
+
+    def __init__(self, key_hash, meta, content):
+        self.key_hash = key_hash
+        self.meta = meta
+        self.content = content
+
+    def is_fresh(self, max_age):
+        return self.meta['stored'] + max_age > time.time()
+
+    def get_validators(self):
+        """
+        This method returns the conditional request headers that revalidate this entry.
+        """
+        headers = {}
+        if self.meta.get('etag'):
+            headers['If-None-Match'] = self.meta['etag']
+        if self.meta.get('last_modified'):
+            headers['If-Modified-Since'] = self.meta['last_modified']
+        return headers
+
+    @property
+    def response(self):
+        return build_response(self.meta['url'], 200, self.meta['headers'], self.content, self.meta['encoding'])
+
+
+class DiskCache(object):
+    """
+    A persistent response cache that can be shared by several processes. Bodies are stored zlib-compressed under the
+    SHA-1 of their content, so identical responses are only stored once, and every request key has a small JSON file
+    with the metadata pointing to its body. All files are written atomically. Once the compressed bodies exceed
+    max_size bytes, the least recently used entries are removed.
+    """
+
+    stored_headers = ('content-type', 'etag', 'last-modified')
+
+    def __init__(self, directory, max_size=512 * 1024 * 1024, max_age=3600, compression_level=6, evict_interval=64):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        self.compression_level = compression_level
+        self.evict_interval = evict_interval
+
+        self._stores_since_eviction = evict_interval
+        self._entries_directory = os.path.join(directory, 'entries')
+        self._bodies_directory = os.path.join(directory, 'bodies')
+        for path in (self._entries_directory, self._bodies_directory):
+            ensure_directory(path)
+
+    def _entry_path(self, key_hash):
+        return os.path.join(self._entries_directory, key_hash + '.json')
+
+    def _body_path(self, body_hash):
+        return os.path.join(self._bodies_directory, body_hash + '.z')
+
+    def _read_meta(self, path):
+        try:
+            with open(path, 'rb') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def get(self, cache_key):
+        """
+        This method returns the DiskCacheEntry for the given key or None. The entry might be stale, use is_fresh to check.
+        """
+        key_hash = hash_cache_key(cache_key)
+        entry_path = self._entry_path(key_hash)
+        meta = self._read_meta(entry_path)
+        if meta is None:
+            return None
+        try:
+            with open(self._body_path(meta['body']), 'rb') as f:
+                content = zlib.decompress(f.read())
+        except (IOError, zlib.error):
+            # the body got evicted by another process
+            return None
+        try:
+            # the access time is used for the LRU eviction
+            os.utime(entry_path, None)
+        except OSError:
+            pass
+        return DiskCacheEntry(key_hash, meta, content)
+
+    def set(self, cache_key, response):
+        """
+        This method stores the content of the given response under the given key.
+        """
+        content = response.content or ''
+        body_hash = hashlib.sha1(content).hexdigest()
+        body_path = self._body_path(body_hash)
+        if not os.path.exists(body_path):
+            write_atomically(body_path, zlib.compress(content, self.compression_level))
+        headers = dict((name, response.headers[name]) for name in self.stored_headers if response.headers.get(name))
+        meta = {
+            'url': response.url,
+            'encoding': response.encoding,
+            'headers': headers,
+            'etag': headers.get('etag'),
+            'last_modified': headers.get('last-modified'),
+            'body': body_hash,
+            'stored': time.time(),
+        }
+        write_atomically(self._entry_path(hash_cache_key(cache_key)), json.dumps(meta))
+
+        self._stores_since_eviction += 1
+        if self._stores_since_eviction >= self.evict_interval:
+            self._stores_since_eviction = 0
+            self.evict()
+
+    def refresh(self, entry, response):
+        """
+        This method marks the given entry as fresh again after the server answered a revalidation with 304.
+        """
+        meta = dict(entry.meta)
+        meta['stored'] = time.time()
+        for header, key in (('etag', 'etag'), ('last-modified', 'last_modified')):
+            if response.headers.get(header):
+                meta[key] = response.headers[header]
+        write_atomically(self._entry_path(entry.key_hash), json.dumps(meta))
+
+    def evict(self):
+        """
+        This method removes the least recently used entries until the stored bodies fit into max_size and deletes all
+        bodies that are no longer referenced. Only one process evicts at a time.
+        """
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                entries = []
+                for name in os.listdir(self._entries_directory):
+                    if not name.endswith('.json'):
+                        continue
+                    path = os.path.join(self._entries_directory, name)
+                    meta = self._read_meta(path)
+                    try:
+                        used = os.path.getmtime(path)
+                    except OSError:
+                        continue
+                    if meta is not None:
+                        entries.append((used, path, meta['body']))
+                entries.sort()
+
+                body_sizes = {}
+                for name in os.listdir(self._bodies_directory):
+                    if name.endswith('.z'):
+                        try:
+                            body_sizes[name[:-2]] = os.path.getsize(os.path.join(self._bodies_directory, name))
+                        except OSError:
+                            pass
+
+                references = {}
+                for used, path, body_hash in entries:
+                    references[body_hash] = references.get(body_hash, 0) + 1
+                total_size = sum(size for body_hash, size in body_sizes.iteritems() if body_hash in references)
+
+                for used, path, body_hash in entries:
+                    if total_size <= self.max_size:
+                        break
+                    os.remove(path)
+                    references[body_hash] -= 1
+                    if not references[body_hash]:
+                        total_size -= body_sizes.get(body_hash, 0)
+
+                for body_hash in body_sizes:
+                    if not references.get(body_hash):
+                        try:
+                            os.remove(self._body_path(body_hash))
+                        except OSError:
+                            pass
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
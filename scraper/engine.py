@@ -0,0 +1,221 @@
+import threading, Queue, sys, collections, time
+
+
+class Future(object):
+    """
+    The result of a call that has been submitted to a FetchEngine.
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        This method waits for the call to finish and returns its result or re-raises its exception. If the call is not
+        finished after timeout seconds, EngineTimeout is raised.
+        """
+        if not self._done.wait(timeout):
+            raise EngineTimeout(u'call did not finish within %s seconds' % timeout)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise EngineTimeout(u'call did not finish within %s seconds' % timeout)
+        if self._exc_info is not None:
+            return self._exc_info[1]
+        return None
+
+    def add_done_callback(self, callback):
+        """
+        The given callback is called with the future as its only argument as soon as the call finishes. If the call
+        has already finished, it is called immediately.
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _set(self, result, exc_info):
+        with self._lock:
+            self._result = result
+            self._exc_info = exc_info
+            self._done.set()
+            callbacks = self._callbacks
+            self._callbacks = []
+        for callback in callbacks:
+            callback(self)
+
+
+class EngineTimeout(Exception):
+    pass
+
+
+# set in the worker threads of all engines
+_worker = threading.local()
+
+
+def in_engine_worker():
+    """
+    This function returns True if it is called on a worker thread of a FetchEngine. Code running there must not wait
+    for other calls submitted to an engine, they might never get a free worker.
+    """
+    return getattr(_worker, 'engine', None) is not None
+
+
+class FetchEngine(object):
+    """
+    Runs fetches on at most max_workers worker threads, which are only started when there are calls for them. Calls
+    are queued per host and at most per_host_limit of them run against the same host at the same time, so a slow or
+    busy host never occupies all workers.
+
+    shutdown stops the workers once all submitted calls are finished. Used as a context manager, the engine is shut
+    down when the block is left.
+    """
+
+    def __init__(self, max_workers=64, per_host_limit=8):
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+
+        self._ready = Queue.Queue()
+        self._pending = collections.defaultdict(collections.deque)
+        self._active = collections.defaultdict(int)
+        self._lock = threading.Lock()
+        self._drained = threading.Condition(self._lock)
+        self._workers = []
+        self._idle = 0
+        self._queued = 0
+        self._shutdown = False
+        self._stopping = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def _schedule(self, host):
+        # must be called with self._lock held
+        pending = self._pending[host]
+        while pending and self._active[host] < self.per_host_limit:
+            self._active[host] += 1
+            self._ready.put((host, pending.popleft()))
+            self._queued += 1
+            if self._queued > self._idle and len(self._workers) < self.max_workers:
+                worker = threading.Thread(target=self._work)
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+                self._idle += 1
+        if not pending:
+            del self._pending[host]
+
+    def _stop_if_drained(self):
+        # must be called with self._lock held, the workers are stopped once the engine is shut down and idle
+        if self._shutdown and not self._stopping and not self._active and not self._pending:
+            self._stopping = True
+            for worker in self._workers:
+                self._ready.put(None)
+            self._drained.notify_all()
+
+    def _work(self):
+        _worker.engine = self
+        while True:
+            item = self._ready.get()
+            with self._lock:
+                self._idle -= 1
+                if item is None:
+                    return
+                self._queued -= 1
+            host, (future, fn, args, kwargs) = item
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException:
+                future._set(None, sys.exc_info())
+            else:
+                future._set(result, None)
+            with self._lock:
+                self._idle += 1
+                self._active[host] -= 1
+                if not self._active[host]:
+                    del self._active[host]
+                self._schedule(host)
+                self._stop_if_drained()
+
+    def submit(self, host, fn, *args, **kwargs):
+        """
+        This method queues the call fn(*args, **kwargs) for the given host and returns a Future for its result.
+        """
+        future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError(u'cannot submit calls to an engine that has been shut down')
+            self._pending[host].append((future, fn, args, kwargs))
+            self._schedule(host)
+        return future
+
+    def shutdown(self, wait=True):
+        """
+        This method makes the engine refuse further calls and stops its workers as soon as the calls already submitted
+        are finished. If wait is True, it returns once they are finished and the workers have exited.
+        """
+        if wait and getattr(_worker, 'engine', None) is self:
+            raise RuntimeError(u'a worker cannot wait for the shutdown of its own engine')
+        with self._lock:
+            self._shutdown = True
+            self._stop_if_drained()
+            if not wait:
+                return
+            while not self._stopping:
+                self._drained.wait()
+            workers = list(self._workers)
+        for worker in workers:
+            if worker is not threading.current_thread():
+                worker.join()
+
+    def map(self, host, fn, iterable):
+        return [self.submit(host, fn, item) for item in iterable]
+
+
+def as_completed(futures, timeout=None):
+    """
+    This generator yields the given futures in the order they finish. If not all of them finished after timeout
+    seconds, EngineTimeout is raised.
+    """
+    finished = Queue.Queue()
+    futures = list(futures)
+    for future in futures:
+        future.add_done_callback(finished.put)
+    end = time.time() + timeout if timeout is not None else None
+    for i in range(len(futures)):
+        try:
+            if end is None:
+                yield finished.get()
+            else:
+                yield finished.get(timeout=max(end - time.time(), 0))
+        except Queue.Empty:
+            raise EngineTimeout(u'%d of %d calls did not finish within %s seconds' % (len(futures) - i, len(futures), timeout))
+
+
+_default_engine = None
+_default_engine_lock = threading.Lock()
+
+
+def get_default_engine():
+    """
+    This function returns the engine that is used when no engine is given explicitly.
+    """
+    global _default_engine
+    with _default_engine_lock:
+        if _default_engine is None:
+            _default_engine = FetchEngine()
+    return _default_engine
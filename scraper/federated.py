@@ -0,0 +1,152 @@
+import threading, time, re, logging, Queue
+from registry import get_default_registry
+from deadline import Deadline
+
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_title(title):
+    """
+    This function returns the given release title in lower case and without punctuation, so that titles that only
+    differ in their formatting compare equal.
+    """
+    return u' '.join(re.findall(r'\w+', title.lower(), re.UNICODE))
+
+
+def normalize_catalog(catalog):
+    if not catalog:
+        return None
+    return re.sub(r'[\W_]+', '', catalog.lower(), flags=re.UNICODE) or None
+
+
+class FederatedSearch(object):
+    """
+    Searches all scrapers of a registry concurrently. The entries of the releases lists of all sources are yielded as
+    soon as they arrive, with an additional 'source' key holding the READABLE_NAME of their scraper. Releases that were
+    already found by another source (same catalog number or same normalized name) are left out.
+
+    Every source has a deadline, after which its search is abandoned: its requests still in flight are cut short
+    and no further pages are fetched. The entries it returned until then are kept, the source is added to timed_out.
+    Sources whose search failed are added to errors.
+    """
+
+    deadline = 10.0
+    max_results = 25
+
+    _DONE = object()
+
+    def __init__(self, search_term, registry=None, deadline=None, deadlines=None, max_results=None):
+        """
+        deadline is the number of seconds every source has to return its results, deadlines a dictionary with the
+        deadlines of single sources by READABLE_NAME. max_results limits the number of entries taken from each source
+        (25 by default), only as many pages as needed for them are fetched.
+        """
+        self.search_term = search_term
+        self.registry = registry
+        if deadline is not None:
+            self.deadline = deadline
+        self.deadlines = deadlines or {}
+        if max_results is not None:
+            self.max_results = max_results
+
+        self.timed_out = []
+        self.errors = {}
+        self._releases = None
+
+    def get_registry(self):
+        if self.registry is None:
+            return get_default_registry()
+        return self.registry
+
+    def get_deadline(self, source):
+        return self.deadlines.get(source, self.deadline)
+
+    def get_sources(self):
+        """
+        This method returns a list with the READABLE_NAME and the Search instance of every source.
+        """
+        return [(module.READABLE_NAME, module.Search(self.search_term)) for module in self.get_registry().modules]
+
+    @property
+    def releases(self):
+        if self._releases is None:
+            self._releases = list(self.iter_releases())
+        return self._releases
+
+    def _run_source(self, source, search, results, stopped):
+        try:
+            for release in search.iter_releases(max_results=self.max_results):
+                if stopped.is_set():
+                    return
+                results.put((source, release))
+        except Exception as e:
+            results.put((source, e))
+        else:
+            results.put((source, self._DONE))
+
+    def iter_releases(self):
+        """
+        This generator yields the deduplicated entries of all sources in the order they arrive.
+        """
+        results = Queue.Queue()
+        stopped = threading.Event()
+        start = time.time()
+        pending = {}
+        for source, search in self.get_sources():
+            search.deadline = Deadline(self.get_deadline(source))
+            pending[source] = search.deadline.expires
+            thread = threading.Thread(target=self._run_source, args=(source, search, results, stopped))
+            thread.daemon = True
+            thread.start()
+
+        seen_catalogs = set()
+        seen_titles = {}
+        try:
+            while pending:
+                now = time.time()
+                for source, deadline in pending.items():
+                    if deadline <= now:
+                        logger.warning(u'search for "%s" on %s did not finish in time' % (self.search_term, source))
+                        self.timed_out.append(source)
+                        del pending[source]
+                if not pending:
+                    break
+                try:
+                    source, result = results.get(timeout=min(pending.values()) - now)
+                except Queue.Empty:
+                    continue
+                if source not in pending:
+                    continue
+                if result is self._DONE:
+                    del pending[source]
+                elif isinstance(result, Exception):
+                    logger.warning(u'search for "%s" on %s failed: %s' % (self.search_term, source, result))
+                    self.errors[source] = result
+                    del pending[source]
+                elif not self._is_duplicate(result, seen_catalogs, seen_titles):
+                    yield dict(result, source=source)
+        finally:
+            # abandoned sources stop fetching further pages
+            stopped.set()
+
+    def _is_duplicate(self, release, seen_catalogs, seen_titles):
+        """
+        Two releases are the same if they have the same catalog number, or if they have the same normalized name and
+        at most one of them has a catalog number.
+        """
+        catalog = normalize_catalog(release.get('catalog'))
+        title = normalize_title(release['name'] or u'')
+        if catalog is not None and catalog in seen_catalogs:
+            return True
+        if not title:
+            if catalog is not None:
+                seen_catalogs.add(catalog)
+            return False
+        catalogs = seen_titles.setdefault(title, set())
+        if catalogs and (catalog is None or None in catalogs):
+            return True
+        catalogs.add(catalog)
+        if catalog is not None:
+            seen_catalogs.add(catalog)
+        return False
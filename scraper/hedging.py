@@ -0,0 +1,244 @@
+import threading, time, random, sys, collections, Queue
+import requests
+from pool import close_response
+from deadline import DeadlineExceeded
+
+
+class HostLatency(object):
+    """
+    The latencies of the last window responses of a host.
+    """
+
+    def __init__(self, window=200):
+        self._latencies = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def get_percentile(self, percentile, min_samples=1):
+        """
+        This method returns the given percentile of the recorded latencies or None if there are fewer than min_samples.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies or len(latencies) < min_samples:
+            return None
+        index = min(int(len(latencies) * percentile / 100.0), len(latencies) - 1)
+        return latencies[index]
+
+
+class AttemptPool(object):
+    """
+    At most max_workers threads that send the attempts of hedged requests. Attempts are only accepted while a thread
+    is free, so they never wait in a queue.
+    """
+
+    def __init__(self, max_workers=16):
+        self.max_workers = max_workers
+
+        self._tasks = Queue.Queue()
+        self._workers = 0
+        self._idle = 0
+        self._lock = threading.Lock()
+
+    def try_submit(self, function):
+        """
+        This method runs function on a free thread and returns True, or returns False if all threads are busy.
+        """
+        with self._lock:
+            if self._idle:
+                self._idle -= 1
+            elif self._workers < self.max_workers:
+                self._workers += 1
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+            else:
+                return False
+        self._tasks.put(function)
+        return True
+
+    def _work(self):
+        while True:
+            function = self._tasks.get()
+            try:
+                function()
+            finally:
+                with self._lock:
+                    self._idle += 1
+
+
+class HedgePolicy(object):
+    """
+    Decides how GET requests are sent to cut down their tail latency. If a request has not been answered after the
+    hedge_percentile of the latencies observed for its host, a duplicate is sent and whichever response arrives first
+    is used. Requests that failed with a connection error, a timeout or one of retry_status_codes are retried up to
+    retries times, after a random delay of up to backoff * 2 ** attempt seconds.
+
+    Hedged attempts run on a pool of at most max_workers threads. While all of them are busy, requests are sent in the
+    calling thread without a hedge. The responses of the attempts that lose are closed.
+
+    The policy is shared by all instances of the scrapers that use it. Scrapers configure their own by setting the
+    hedge_policy attribute of RequestMixin.
+    """
+
+    RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout)
+
+    def __init__(self, hedge_percentile=95, min_samples=20, min_hedge_delay=0.05, max_hedges=1, retries=2,
+                 backoff=0.5, max_backoff=8.0, retry_status_codes=(502, 504), timeout=30.0, window=200, max_workers=16):
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.min_hedge_delay = min_hedge_delay
+        self.max_hedges = max_hedges
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_status_codes = retry_status_codes
+        self.timeout = timeout
+        self.window = window
+
+        self._attempts = AttemptPool(max_workers)
+        self._latencies = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def get_latency(self, host):
+        with self._lock:
+            latency = self._latencies.get(host)
+            if latency is None:
+                latency = self._latencies[host] = HostLatency(self.window)
+        return latency
+
+    def _count(self, host, counter):
+        with self._lock:
+            stats = self._stats.get(host)
+            if stats is None:
+                stats = self._stats[host] = dict.fromkeys(('requests', 'hedges', 'hedge_wins', 'retries', 'failures'), 0)
+            stats[counter] += 1
+
+    def get_hedge_delay(self, host):
+        """
+        This method returns the number of seconds after which a duplicate request is sent to the host or None if too
+        few latencies have been observed yet.
+        """
+        if not self.max_hedges:
+            return None
+        delay = self.get_latency(host).get_percentile(self.hedge_percentile, self.min_samples)
+        if delay is None:
+            return None
+        return max(delay, self.min_hedge_delay)
+
+    def get_retry_delay(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def send(self, send, host, deadline=None, pace=None):
+        """
+        This method calls send(), which sends a single request and returns its response, until it gets an answer that
+        is not retried and returns it.
+
+        pace(blocking=True) is called in this thread before every request that is sent, including hedges and retries.
+        It waits for the rate limiter of the host (or, with blocking False, returns False instead of waiting, and the
+        hedge is not sent). The delays before retries end at the given Deadline, DeadlineExceeded is raised if it has
+        passed.
+        """
+        self._count(host, 'requests')
+        attempt = 0
+        while True:
+            try:
+                response = self._send_hedged(send, host, pace)
+            except self.RETRY_EXCEPTIONS:
+                if attempt >= self.retries:
+                    self._count(host, 'failures')
+                    raise
+            else:
+                if response.status_code not in self.retry_status_codes or attempt >= self.retries:
+                    return response
+                close_response(response)
+            self._count(host, 'retries')
+            delay = self.get_retry_delay(attempt)
+            if deadline is not None:
+                remaining = deadline.remaining()
+                if remaining <= 0:
+                    raise DeadlineExceeded(u'deadline of %s seconds exceeded before retrying the request' % deadline.seconds)
+                delay = min(delay, remaining)
+            time.sleep(delay)
+            attempt += 1
+
+    def _send_hedged(self, send, host, pace=None):
+        latency = self.get_latency(host)
+        results = Queue.Queue()
+        settled = []
+        settled_lock = threading.Lock()
+
+        def attempt(hedge):
+            start = time.time()
+            try:
+                response = send()
+            except Exception:
+                results.put((hedge, None, sys.exc_info()))
+                return
+            latency.record(time.time() - start)
+            with settled_lock:
+                if not settled:
+                    results.put((hedge, response, None))
+                    return
+            # another attempt has already won
+            close_response(response)
+
+        if pace is not None:
+            pace()
+        delay = self.get_hedge_delay(host)
+        if delay is None or not self._attempts.try_submit(lambda: attempt(False)):
+            # nothing to hedge against yet or no free thread, the request is sent in this thread
+            start_time = time.time()
+            response = send()
+            latency.record(time.time() - start_time)
+            return response
+
+        outstanding = 1
+        hedges = 0
+        exc_info = None
+        while True:
+            try:
+                hedge, response, error = results.get(timeout=delay if hedges < self.max_hedges else None)
+            except Queue.Empty:
+                hedges += 1
+                # a hedge is only sent if the rate limiter has a slot for it right away
+                if (pace is None or pace(False)) and self._attempts.try_submit(lambda: attempt(True)):
+                    self._count(host, 'hedges')
+                    outstanding += 1
+                continue
+            outstanding -= 1
+            if error is None:
+                with settled_lock:
+                    settled.append(hedge)
+                # responses that arrived in the meantime lose
+                while True:
+                    try:
+                        loser = results.get_nowait()[1]
+                    except Queue.Empty:
+                        break
+                    if loser is not None:
+                        close_response(loser)
+                if hedge:
+                    self._count(host, 'hedge_wins')
+                return response
+            if exc_info is None:
+                exc_info = error
+            if not outstanding:
+                raise exc_info[0], exc_info[1], exc_info[2]
+
+    def get_stats(self):
+        """
+        This method returns a dictionary with the request, hedge and retry counts and the hedge delay of each host.
+        """
+        with self._lock:
+            stats = dict((host, dict(counters)) for host, counters in self._stats.iteritems())
+        for host, counters in stats.iteritems():
+            counters['hedge_delay'] = self.get_hedge_delay(host)
+        return stats
+
+
+default_hedge_policy = HedgePolicy()
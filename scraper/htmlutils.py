@@ -0,0 +1,160 @@
+import lxml.etree, lxml.html
+from lxml.cssselect import CSSSelector
+
+
+_compiled_selectors = {}
+
+
+def compile_selector(selector):
+    """
+    This function returns the compiled CSSSelector for the given CSS selector. Every selector is translated to XPath
+    only once per process, the compiled selectors are shared by all scrapers and instances.
+    """
+    compiled = _compiled_selectors.get(selector)
+    if compiled is None:
+        try:
+            compiled = CSSSelector(selector, translator='html')
+        except TypeError:
+            # lxml < 3.0 has no translators, its CSSSelector always behaves like the HTML one
+            compiled = CSSSelector(selector)
+        _compiled_selectors[selector] = compiled
+    return compiled
+
+
+def select(element, selector):
+    """
+    This function does the same as element.cssselect(selector), but with a cached compiled selector.
+    """
+    return compile_selector(selector)(element)
+
+
+class SubtreeCollector(object):
+    """
+    A target for lxml's feed parser that keeps only the subtrees of the elements accepted by match(tag, attrib) and
+    throws away everything else while the document is parsed. Once an element accepted by stop_after(tag, attrib) is
+    closed, done is set and all further events are ignored, so the caller can stop feeding.
+
+    build_document() returns a small document that contains the collected subtrees. Collected elements that were
+    siblings in the original document are siblings again and are only adjacent if they were adjacent before, so
+    selectors like 'label + span.spec' still match the same elements.
+    """
+
+    def __init__(self, match, stop_after=None):
+        self.match = match
+        self.stop_after = stop_after
+        self.done = False
+
+        # (parent id, preceded by an element that was not collected, element) of each collected subtree
+        self._collected = []
+        # [element id, last child was not collected] of each open element outside of the collected subtrees
+        self._stack = []
+        self._next_id = 0
+        self._builder = None
+        self._builder_depth = 0
+        self._stop_depth = None
+
+    def start(self, tag, attrib):
+        if self.done:
+            return
+        # checked first, the TreeBuilder takes over the attrib dictionary
+        stop_here = self.stop_after is not None and self._stop_depth is None and self.stop_after(tag, attrib)
+        if self._builder is not None:
+            self._builder_depth += 1
+            self._builder.start(tag, attrib)
+        elif self.match(tag, attrib):
+            self._builder = lxml.etree.TreeBuilder(parser=lxml.html.HTMLParser())
+            self._builder_depth = 1
+            self._builder.start(tag, attrib)
+        else:
+            self._next_id += 1
+            self._stack.append([self._next_id, False])
+        if stop_here:
+            self._stop_depth = len(self._stack) + self._builder_depth
+
+    def end(self, tag):
+        if self.done:
+            return
+        depth = len(self._stack) + self._builder_depth
+        if self._builder is not None:
+            self._builder.end(tag)
+            self._builder_depth -= 1
+            if not self._builder_depth:
+                parent = self._stack[-1] if self._stack else [0, False]
+                self._collected.append((parent[0], parent[1], self._builder.close()))
+                parent[1] = False
+                self._builder = None
+        elif self._stack:
+            self._stack.pop()
+            if self._stack:
+                # the next collected sibling is not adjacent to the previous one anymore
+                self._stack[-1][1] = True
+        if self._stop_depth == depth:
+            self.done = True
+
+    def data(self, data):
+        if self._builder is not None and not self.done:
+            self._builder.data(data)
+
+    def close(self):
+        return self.build_document()
+
+    def build_document(self):
+        document = lxml.html.document_fromstring('<html><body></body></html>')
+        body = document.find('body')
+        wrappers = {}
+        for parent_id, preceded_by_gap, element in self._collected:
+            wrapper = wrappers.get(parent_id)
+            if wrapper is None:
+                wrapper = wrappers[parent_id] = lxml.etree.SubElement(body, 'div')
+            elif preceded_by_gap:
+                lxml.etree.SubElement(wrapper, 'span')
+            wrapper.append(element)
+        return document
+
+
+def parse_subtrees(chunks, match, stop_after=None, encoding=None):
+    """
+    This function feeds the given chunks of an HTML document to an incremental parser and returns the document built
+    by a SubtreeCollector. It stops reading chunks as soon as the collector is done.
+    """
+    collector = SubtreeCollector(match, stop_after)
+    parser = lxml.etree.HTMLParser(target=collector, encoding=encoding)
+    pending = ''
+    for chunk in chunks:
+        # libxml2's HTML push parser can stall until close() if a chunk ends inside a tag, so the chunks are only fed
+        # up to their last '>'
+        pending += chunk
+        cut = pending.rfind('>') + 1
+        if cut:
+            parser.feed(pending[:cut])
+            pending = pending[cut:]
+            if collector.done:
+                return parser.close()
+    if pending:
+        parser.feed(pending)
+    return parser.close()
+
+
+def element_matcher(*selectors):
+    """
+    This function returns a match function for SubtreeCollector that accepts elements described by simple selectors
+    of the form 'tag' or 'tag.class1.class2'.
+    """
+    parsed = []
+    for selector in selectors:
+        parts = selector.split('.')
+        parsed.append((parts[0], set(parts[1:])))
+
+    def match(tag, attrib):
+        classes = None
+        for selector_tag, selector_classes in parsed:
+            if tag != selector_tag:
+                continue
+            if selector_classes:
+                if classes is None:
+                    classes = set(attrib.get('class', '').split())
+                if not selector_classes <= classes:
+                    continue
+            return True
+        return False
+    return match
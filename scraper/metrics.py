@@ -0,0 +1,202 @@
+import threading, bisect
+from cache import default_response_cache
+
+
+def _escape(value):
+    return unicode(value).replace(u'\\', u'\\\\').replace(u'"', u'\\"').replace(u'\n', u'\\n')
+
+
+def _format_labels(labelnames, labels, extra=()):
+    pairs = zip(labelnames, labels) + list(extra)
+    if not pairs:
+        return u''
+    return u'{%s}' % u','.join(u'%s="%s"' % (name, _escape(value)) for name, value in pairs)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return u'+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return unicode(int(value))
+    return unicode(repr(value))
+
+
+class Counter(object):
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        """
+        This method adds amount to the value with the given label values, given in the order of labelnames.
+        """
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, labels=()):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def collect(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [u'%s%s %s' % (self.name, _format_labels(self.labelnames, labels), _format_value(value))
+                for labels, value in values]
+
+
+class Histogram(object):
+    type = 'histogram'
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count of each bucket (not cumulative) and of +Inf, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][index] += 1
+            counts[1] += value
+
+    def get_count(self, labels=()):
+        with self._lock:
+            counts = self._values.get(labels)
+            return sum(counts[0]) if counts is not None else 0
+
+    def collect(self):
+        with self._lock:
+            values = sorted((labels, (list(counts[0]), counts[1])) for labels, counts in self._values.items())
+        lines = []
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append(u'%s_bucket%s %d' % (self.name, _format_labels(self.labelnames, labels, [('le', _format_value(float(bound)))]), cumulative))
+            lines.append(u'%s_sum%s %s' % (self.name, _format_labels(self.labelnames, labels), _format_value(total)))
+            lines.append(u'%s_count%s %d' % (self.name, _format_labels(self.labelnames, labels), cumulative))
+        return lines
+
+
+class MetricsRegistry(object):
+    """
+    A set of metrics that can be exported in the Prometheus text format. Besides counters and histograms, collectors
+    can be added: callables that return a list of (name, type, help, [(labels dictionary, value), ...]) when the
+    metrics are exported, for values that are kept elsewhere (e.g. the statistics of a cache).
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def add_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def to_prometheus(self):
+        """
+        This method returns all metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.append(u'# HELP %s %s' % (metric.name, metric.help))
+            lines.append(u'# TYPE %s %s' % (metric.name, metric.type))
+            lines.extend(metric.collect())
+        for collector in collectors:
+            for name, type, help, samples in collector():
+                lines.append(u'# HELP %s %s' % (name, help))
+                lines.append(u'# TYPE %s %s' % (name, type))
+                for labels, value in samples:
+                    labelnames = sorted(labels)
+                    lines.append(u'%s%s %s' % (name, _format_labels(labelnames, [labels[key] for key in labelnames]), _format_value(value)))
+        return u'\n'.join(lines) + u'\n'
+
+
+class ScraperMetrics(object):
+    """
+    The metrics of the scrapers, labeled by scraper module and operation ('release', 'search', ...):
+
+    - scraper_requests_total: requests by status code ('error' if no response was received)
+    - scraper_request_duration_seconds: latency of the requests
+    - scraper_response_bytes_total: bytes received
+    - scraper_parse_duration_seconds: time spent decoding and parsing responses
+    - scraper_exceptions_total: exceptions raised to the caller, by class
+    - scraper_not_found_total: searches the site answered with an error because nothing was found
+    """
+
+    def __init__(self, registry=None):
+        if registry is None:
+            registry = MetricsRegistry()
+        self.registry = registry
+        labelnames = ('scraper', 'operation')
+        self.requests = registry.counter('scraper_requests_total', u'Requests sent by the scrapers.', labelnames + ('status',))
+        self.request_duration = registry.histogram('scraper_request_duration_seconds', u'Latency of the requests.', labelnames)
+        self.response_bytes = registry.counter('scraper_response_bytes_total', u'Bytes received in responses.', labelnames)
+        self.parse_duration = registry.histogram('scraper_parse_duration_seconds', u'Time spent decoding and parsing responses.', labelnames)
+        self.exceptions = registry.counter('scraper_exceptions_total', u'Exceptions raised to the caller.', labelnames + ('exception',))
+        self.not_found = registry.counter('scraper_not_found_total', u'Searches without results reported as server errors.', labelnames)
+
+    def record_request(self, scraper, operation, status, seconds, size=None):
+        self.requests.inc((scraper, operation, str(status)))
+        self.request_duration.observe(seconds, (scraper, operation))
+        if size:
+            self.response_bytes.inc((scraper, operation), size)
+
+    def record_parse(self, scraper, operation, seconds):
+        self.parse_duration.observe(seconds, (scraper, operation))
+
+    def record_exception(self, scraper, operation, exception):
+        self.exceptions.inc((scraper, operation, exception.__class__.__name__))
+
+    def record_not_found(self, scraper, operation):
+        self.not_found.inc((scraper, operation))
+
+    def add_stats_collector(self, name, help, get_stats, labels=None, gauges=('size',)):
+        """
+        This method exports the numbers returned by get_stats() (e.g. ResponseCache.get_stats): the keys listed in gauges
+        as gauges name_<key>, all other keys, which only ever increase (hits, misses, ...), as counters name_<key>_total.
+        """
+        def collect():
+            stats = get_stats()
+            metrics = []
+            for key, value in sorted(stats.iteritems()):
+                if not isinstance(value, (int, long, float)):
+                    continue
+                if key in gauges:
+                    metrics.append(('%s_%s' % (name, key), 'gauge', help, [(labels or {}, value)]))
+                else:
+                    metrics.append(('%s_%s_total' % (name, key), 'counter', help, [(labels or {}, value)]))
+            return metrics
+        self.registry.add_collector(collect)
+
+
+default_metrics = ScraperMetrics()
+default_metrics.add_stats_collector('scraper_response_cache', u'Statistics of the shared response cache.', default_response_cache.get_stats)
@@ -0,0 +1,162 @@
+import threading, weakref
+
+
+# strings cannot be referenced weakly, so the table is emptied whenever it reaches this size
+MAX_INTERNED = 100000
+
+_interned = {}
+
+
+def intern_string(value):
+    """
+    This function returns a shared instance of the given str or unicode string. The type of the string is preserved,
+    so that the conversion back to the data dictionary is lossless. At most MAX_INTERNED strings are remembered.
+    """
+    if value is None:
+        return None
+    if len(_interned) >= MAX_INTERNED:
+        _interned.clear()
+    return _interned.setdefault((type(value), value), value)
+
+
+def _intern_all(values):
+    if values is None:
+        return None
+    return tuple(intern_string(value) for value in values)
+
+
+class ArtistCredit(object):
+    __slots__ = ('name', 'type', '__weakref__')
+
+    # a credit is only shared as long as a release refers to it
+    _instances = weakref.WeakValueDictionary()
+    _lock = threading.Lock()
+
+    def __init__(self, name, type):
+        self.name = name
+        self.type = type
+
+    @classmethod
+    def get(cls, name, type):
+        """
+        This method returns the shared credit for the given artist name and type.
+        """
+        key = (type.__class__, type, name.__class__, name)
+        credit = cls._instances.get(key)
+        if credit is None:
+            with cls._lock:
+                credit = cls._instances.get(key)
+                if credit is None:
+                    credit = cls._instances[key] = cls(intern_string(name), intern_string(type))
+        return credit
+
+    @classmethod
+    def from_dict(cls, artist):
+        return cls.get(artist['name'], artist['type'])
+
+    def to_dict(self):
+        return {'name': self.name, 'type': self.type}
+
+    def __repr__(self):
+        return 'ArtistCredit(%r, %r)' % (self.name, self.type)
+
+
+def _credits(artists):
+    if artists is None:
+        return None
+    return tuple(ArtistCredit.from_dict(artist) for artist in artists)
+
+
+def _credit_dicts(credits):
+    if credits is None:
+        return None
+    return [credit.to_dict() for credit in credits]
+
+
+class Track(object):
+    __slots__ = ('number', 'artists', 'title', 'length')
+
+    def __init__(self, number, artists, title, length):
+        self.number = number
+        self.artists = artists
+        self.title = title
+        self.length = length
+
+    @classmethod
+    def from_tuple(cls, track):
+        number, artists, title, length = track
+        return cls(intern_string(number), _credits(artists), title, intern_string(length))
+
+    def to_tuple(self):
+        return self.number, _credit_dicts(self.artists), self.title, self.length
+
+
+class Disc(object):
+    __slots__ = ('number', 'title', 'tracks')
+
+    def __init__(self, number, title, tracks):
+        self.number = number
+        self.title = title
+        self.tracks = tracks
+
+
+class CompactRelease(object):
+    """
+    A compact representation of the data dictionary of a release, for keeping many releases in memory. All records
+    use __slots__, artist credits are shared between all releases and frequently repeated strings (names, artist types,
+    labels, genres, track numbers and lengths) are interned. from_data and to_data convert losslessly between this
+    model and the data dictionary.
+    """
+
+    __slots__ = ('released', 'format', 'label', 'catalog', 'title', 'artists', 'genre', 'style', 'country', 'link',
+                 'discs')
+
+    # the fields of the data dictionary that are lists of strings
+    _list_fields = ('label', 'catalog', 'genre', 'style')
+
+    def __init__(self, **kwargs):
+        for field in self.__slots__:
+            setattr(self, field, kwargs.get(field))
+
+    @classmethod
+    def from_data(cls, data):
+        """
+        This method creates a compact release from a data dictionary as returned by BaseRelease.data.
+        """
+        release = cls(
+            released=intern_string(data.get('released')),
+            format=intern_string(data.get('format')),
+            title=data.get('title'),
+            artists=_credits(data.get('artists')),
+            country=intern_string(data.get('country')),
+            link=data.get('link'),
+        )
+        for field in cls._list_fields:
+            setattr(release, field, _intern_all(data.get(field)))
+        if 'discs' in data:
+            disc_titles = data.get('discTitles', {})
+            release.discs = tuple(Disc(number, disc_titles.get(number), tuple(map(Track.from_tuple, tracks)))
+                                  for number, tracks in sorted(data['discs'].iteritems()))
+        return release
+
+    def to_data(self):
+        """
+        This method returns the data dictionary this release was created from.
+        """
+        data = {}
+        for field in ('released', 'format', 'title', 'country', 'link'):
+            value = getattr(self, field)
+            if value is not None:
+                data[field] = value
+        for field in self._list_fields:
+            value = getattr(self, field)
+            if value is not None:
+                data[field] = list(value)
+        if self.artists is not None:
+            data['artists'] = _credit_dicts(self.artists)
+        if self.discs is not None:
+            data['discs'] = dict((disc.number, [track.to_tuple() for track in disc.tracks]) for disc in self.discs)
+            disc_titles = dict((disc.number, disc.title) for disc in self.discs if disc.title is not None)
+            if disc_titles:
+                data['discTitles'] = disc_titles
+        return data
@@ -0,0 +1,82 @@
+import multiprocessing, threading
+from cache import build_response
+
+
+# instance attributes that are not sent to the worker processes
+_LOCAL_ATTRIBUTES = ('_cached_response', '_data', '_field_values', '_prepared', 'deadline')
+
+_PLAIN_TYPES = (type(None), bool, int, long, float, str, unicode)
+
+
+def _is_plain(value):
+    """
+    This function returns True if the value is plain data (e.g. an id or a name) and not a configuration object like a
+    DataCache or a HedgePolicy, which might hold locks or threads.
+    """
+    if isinstance(value, _PLAIN_TYPES):
+        return True
+    if isinstance(value, (list, tuple)):
+        return all(_is_plain(item) for item in value)
+    if isinstance(value, dict):
+        return all(_is_plain(key) and _is_plain(item) for key, item in value.iteritems())
+    return False
+
+
+def _extract_release(release_class, state, url, status_code, headers, content, encoding):
+    """
+    This function runs in a worker process: it rebuilds the release and its response and returns the data.
+    """
+    release = release_class.__new__(release_class)
+    release.__dict__.update(state)
+    release._cached_response = build_response(url, status_code, headers, content, encoding)
+    return release._extract_infos()
+
+
+class ProcessExtractor(object):
+    """
+    Runs the CPU-bound part of resolving releases, prepare_response_content and all getters, in a pool of processes,
+    so that parsing is not limited to a single core by the GIL. Responses are still fetched in the calling thread
+    (including the caches, rate limiting and hedging) and only the raw body is sent to the pool, which sends back the
+    data dictionary.
+
+    The pool is started when the extractor is created. The worker processes are forked from the current process and
+    Python 2 cannot start them any other way, so the extractor has to be created before any threads are started
+    (including those of a FetchEngine, a HedgePolicy or a FederatedSearch); otherwise RuntimeError is raised.
+    """
+
+    def __init__(self, processes=None):
+        if threading.active_count() > 1:
+            raise RuntimeError(u'the process pool has to be created before any threads are started')
+        self.pool = multiprocessing.Pool(processes)
+
+    def get_state(self, release):
+        """
+        This method returns the instance attributes of the release that the worker process needs to rebuild it: the
+        plain data its constructor stored, like its id. Objects set per instance (caches, metrics, pools, policies) are
+        left out, the worker uses the defaults of the class; they are not needed to parse a response anyway.
+        """
+        return dict((key, value) for key, value in release.__dict__.iteritems()
+                    if key not in _LOCAL_ATTRIBUTES and _is_plain(value))
+
+    def extract(self, release):
+        """
+        This method fetches the response of the release in this thread, extracts its data in the pool and returns it.
+        The data is also stored in the release, so release.data returns it without extracting it again. If the release
+        has a data cache, it is used as for release.data.
+        """
+        data = release.get_cached_data()
+        if data is None:
+            response = release.get_response()
+            result = self.pool.apply_async(_extract_release, (release.__class__, self.get_state(release), response.url,
+                                                              response.status_code, dict(response.headers),
+                                                              response.content, response.encoding))
+            # a timeout keeps the wait interruptible by KeyboardInterrupt
+            data = result.get(timeout=10 ** 9)
+            release.set_cached_data(data)
+        if not data.get('partial'):
+            release._data = data
+        return data
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
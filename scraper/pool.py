@@ -0,0 +1,97 @@
+import threading, urlparse
+import requests
+
+
+class ConnectionPool(object):
+    """
+    A thread-safe registry of requests sessions, one per host. Every request to the same host goes through the same
+    session, so its connections are kept alive and reused instead of being opened anew for every release and search.
+    """
+
+    def __init__(self, pool_maxsize=10, pool_connections=2, keep_alive=True):
+        """
+        pool_maxsize is the number of idle connections kept open per host, pool_connections the number of distinct
+        hosts (e.g. after redirects) a single session keeps pools for.
+        """
+        self.pool_maxsize = pool_maxsize
+        self.pool_connections = pool_connections
+        self.keep_alive = keep_alive
+
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get_host(self, url):
+        """
+        This method returns the key under which the session for the given URL is stored.
+        """
+        parts = urlparse.urlsplit(url)
+        return '%s://%s' % (parts.scheme.lower(), parts.netloc.lower())
+
+    def get_session_config(self):
+        return {
+            'pool_connections': self.pool_connections,
+            'pool_maxsize': self.pool_maxsize,
+            'keep_alive': self.keep_alive,
+        }
+
+    def get_session(self, url):
+        """
+        This method returns the shared session for the host of the given URL, creating it if necessary.
+        """
+        host = self.get_host(url)
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.session(config=self.get_session_config())
+                self._sessions[host] = session
+        return session
+
+    def get_stats(self):
+        """
+        This method returns a dictionary with the connection reuse statistics of each host. A hit is a request that
+        was sent over an already open connection, a miss is a request that had to open a new one.
+        """
+        with self._lock:
+            sessions = self._sessions.items()
+        stats = {}
+        for host, session in sessions:
+            connection_pool = session.poolmanager.connection_from_url(host)
+            misses = connection_pool.num_connections
+            stats[host] = {
+                'requests': connection_pool.num_requests,
+                'hits': max(connection_pool.num_requests - misses, 0),
+                'misses': misses,
+            }
+        return stats
+
+    def close(self):
+        """
+        This method closes all pooled connections and forgets the sessions.
+        """
+        with self._lock:
+            sessions = self._sessions.values()
+            self._sessions = {}
+        for session in sessions:
+            session.close()
+
+
+def close_response(response):
+    """
+    This function gives up the given response. If its body has not been read completely, the connection cannot be
+    reused for another request, so it is closed before it is handed back to its pool.
+    """
+    raw = getattr(response, 'raw', None)
+    if raw is None:
+        return
+    if not response._content_consumed:
+        fp = getattr(raw, '_fp', None)
+        if fp is not None:
+            fp.close()
+        connection = getattr(raw, '_connection', None)
+        if connection is not None:
+            connection.close()
+    if hasattr(raw, 'release_conn'):
+        raw.release_conn()
+
+
+default_connection_pool = ConnectionPool()
@@ -0,0 +1,231 @@
+# coding=utf-8
+"""
+Profiles the extraction of a single release or search and shows where the time goes.
+
+    python -m scraper.profile URL [--replay DIRECTORY] [--repeat N] [--flamegraph FILE]
+    python -m scraper.profile --search TERM [--scraper NAME] [--replay DIRECTORY] [--repeat N] [--flamegraph FILE]
+
+The response is fetched once (or replayed from a fixtures directory) and the extraction is then run repeat times on
+fresh instances. The report ranks the getters and CSS selectors by their inclusive time. The objects column counts the
+container objects (lists, dicts, elements, ...) that were allocated and not freed during the calls; the garbage
+collector is disabled while profiling so the counts are exact.
+
+--flamegraph writes the samples of a sampling profiler in the collapsed stack format that flamegraph.pl and speedscope
+read. The timer of the kernel is coarse, use a --repeat of a few hundred to get enough samples.
+"""
+from __future__ import absolute_import
+import argparse, gc, os, signal, sys, time
+
+from scraper import htmlutils
+from scraper.base import BaseRelease, RequestMixin
+from scraper.registry import get_default_registry
+from scraper.replay import ReplayTransport
+
+
+RELEASE_GETTERS = ['get_response_content', 'prepare_response_content'] + sorted(BaseRelease.field_getters.values()) + [
+    'get_disc_containers', 'get_disc_title', 'get_track_containers', 'get_track_number', 'get_track_artists',
+    'get_track_title', 'get_track_length']
+
+SEARCH_GETTERS = ['get_response_content', 'prepare_response_content', 'get_release_containers', 'get_release_name',
+                  'get_release_info', 'get_release_catalog', 'get_release_instance']
+
+
+class CallProfiler(object):
+    """
+    Aggregates the time and the allocated objects of calls by name.
+    """
+
+    def __init__(self):
+        # name -> [calls, seconds, objects]
+        self.totals = {}
+
+    def wrap(self, name, function):
+        totals = self.totals.setdefault(name, [0, 0.0, 0])
+
+        def profiled(*args, **kwargs):
+            objects = gc.get_count()[0]
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                totals[0] += 1
+                totals[1] += time.time() - start
+                totals[2] += gc.get_count()[0] - objects
+        return profiled
+
+    def instrument(self, instance, names):
+        for name in names:
+            setattr(instance, name, self.wrap(name, getattr(instance, name)))
+
+    def get_ranking(self):
+        return sorted(((name,) + tuple(totals) for name, totals in self.totals.iteritems() if totals[0]),
+                      key=lambda x: -x[2])
+
+
+class SelectorProfiler(CallProfiler):
+    """
+    Aggregates the calls of htmlutils.select by selector while it is installed in the scraper modules.
+    """
+
+    def __init__(self, modules):
+        super(SelectorProfiler, self).__init__()
+        self.modules = [module for module in modules if getattr(module, 'select', None) is htmlutils.select]
+        self._selects = {}
+
+    def select(self, element, selector):
+        select = self._selects.get(selector)
+        if select is None:
+            select = self._selects[selector] = self.wrap(u"select('%s')" % selector, htmlutils.select)
+        return select(element, selector)
+
+    def __enter__(self):
+        for module in self.modules:
+            module.select = self.select
+        return self
+
+    def __exit__(self, *exc_info):
+        for module in self.modules:
+            module.select = htmlutils.select
+
+
+class SamplingProfiler(object):
+    """
+    Samples the stack of the main thread every interval seconds of CPU time.
+    """
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.stacks = {}
+
+    def _sample(self, signum, frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(u'%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        stack = u';'.join(reversed(names))
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def __enter__(self):
+        self._previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        return self
+
+    def __exit__(self, *exc_info):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._previous_handler)
+
+    def write_collapsed(self, f):
+        for stack, count in sorted(self.stacks.iteritems()):
+            f.write((u'%s %d\n' % (stack, count)).encode('utf-8'))
+
+
+class Target(object):
+
+    def __init__(self, name, factory, getters, extract):
+        self.name = name
+        self.factory = factory
+        self.getters = getters
+        self.extract = extract
+
+
+def get_targets(args, registry):
+    if args.search is None:
+        if registry.release_from_url(args.url) is None:
+            raise ValueError(u'no scraper handles %s' % args.url)
+        return [Target(args.url, lambda: registry.release_from_url(args.url), RELEASE_GETTERS,
+                       lambda instance: instance._extract_infos())]
+    modules = registry.modules
+    if args.scraper is not None:
+        modules = [module for module in modules if module.READABLE_NAME.lower() == args.scraper.lower()]
+        if not modules:
+            raise ValueError(u'unknown scraper: %s' % args.scraper)
+    search_term = args.search.decode(sys.getfilesystemencoding() or 'utf-8')
+    return [Target(u'%s search "%s"' % (module.READABLE_NAME, search_term),
+                   lambda module=module: module.Search(search_term), SEARCH_GETTERS,
+                   lambda instance: instance._extract_releases()) for module in modules]
+
+
+def profile_target(target, repeat, registry, sampler=None):
+    """
+    Fetches the response of the target once and profiles repeat extractions. Returns the fetch time, the time per
+    extraction and the rankings of the getters and selectors.
+    """
+    start = time.time()
+    response = target.factory().get_response()
+    fetch_time = time.time() - start
+
+    getters = CallProfiler()
+    selectors = SelectorProfiler(registry.modules)
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    if sampler is not None:
+        sampler.__enter__()
+    try:
+        with selectors:
+            start = time.time()
+            for i in range(repeat):
+                instance = target.factory()
+                instance._cached_response = response
+                getters.instrument(instance, target.getters)
+                target.extract(instance)
+            extract_time = (time.time() - start) / repeat
+    finally:
+        if sampler is not None:
+            sampler.__exit__()
+        if gc_was_enabled:
+            gc.enable()
+    return fetch_time, extract_time, getters.get_ranking(), selectors.get_ranking()
+
+
+def report(target, fetch_time, extract_time, repeat, getters, selectors, out):
+    out.write((u'%s\n' % target.name).encode('utf-8'))
+    out.write(u'    fetch %.1f ms, extraction %.1f ms per run (%d runs)\n\n' % (fetch_time * 1000, extract_time * 1000, repeat))
+    for title, ranking in ((u'getter', getters), (u'selector', selectors)):
+        if not ranking:
+            continue
+        out.write(u'    %-50s %8s %12s %12s %7s %10s\n' % (title, u'calls', u'total ms', u'us/call', u'%', u'objects'))
+        for name, calls, seconds, objects in ranking:
+            share = seconds / repeat / extract_time * 100 if extract_time else 0.0
+            out.write((u'    %-50s %8d %12.2f %12.1f %6.1f%% %10d\n' % (name[:50], calls / repeat, seconds / repeat * 1000,
+                                                                      seconds / calls * 1000000, share, objects / repeat)).encode('utf-8'))
+        out.write(u'\n')
+
+
+def main(argv=None, out=sys.stdout):
+    parser = argparse.ArgumentParser(prog='python -m scraper.profile', description=u'Profiles the extraction of a release or search.')
+    parser.add_argument('url', nargs='?', help=u'the URL of the release')
+    parser.add_argument('--search', metavar='TERM', help=u'profile a search for the given term instead')
+    parser.add_argument('--scraper', metavar='NAME', help=u'only search with the given scraper (default: all)')
+    parser.add_argument('--replay', metavar='DIRECTORY', help=u'replay the responses recorded in the given directory')
+    parser.add_argument('--repeat', type=int, default=20, help=u'number of extractions (default: 20)')
+    parser.add_argument('--flamegraph', metavar='FILE', help=u'write the samples in the collapsed stack format')
+    args = parser.parse_args(argv)
+    if (args.url is None) == (args.search is None):
+        parser.error(u'either a URL or --search has to be given')
+
+    previous_transport = RequestMixin.transport
+    if args.replay is not None:
+        RequestMixin.transport = ReplayTransport(args.replay)
+    try:
+        registry = get_default_registry()
+        try:
+            targets = get_targets(args, registry)
+        except ValueError as e:
+            parser.error(unicode(e))
+
+        sampler = SamplingProfiler() if args.flamegraph else None
+        for target in targets:
+            fetch_time, extract_time, getters, selectors = profile_target(target, args.repeat, registry, sampler)
+            report(target, fetch_time, extract_time, args.repeat, getters, selectors, out)
+    finally:
+        RequestMixin.transport = previous_transport
+
+    if sampler is not None:
+        with open(args.flamegraph, 'wb') as f:
+            sampler.write_collapsed(f)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
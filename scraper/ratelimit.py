@@ -0,0 +1,185 @@
+import threading, time, email.utils
+import requests
+
+
+class RateLimitTimeout(requests.RequestException):
+    """No request slot became available for a host in time"""
+    pass
+
+
+def parse_retry_after(value):
+    """
+    This function returns the number of seconds a Retry-After header value (either seconds or an HTTP date) asks to
+    wait or None.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(email.utils.mktime_tz(parsed) - time.time(), 0.0)
+
+
+class HostRateLimiter(object):
+    """
+    A token bucket for a single host that adapts its rate to the responses of the host: every successful request
+    increases the rate a little, a 429 or 503 halves it, and a latency above latency_target slowly lowers it. A
+    Retry-After header blocks all requests to the host for the given time.
+
+    With a rate of None (the default) requests are not limited until the host throttles one for the first time; the
+    rate then starts at half of the rate requests were sent at. max_rate caps the rate only if it is given.
+    """
+
+    THROTTLE_STATUS_CODES = (429, 503)
+
+    def __init__(self, rate=None, burst=10, min_rate=0.2, max_rate=None, increase_step=0.5, decrease_factor=0.5,
+                 latency_target=2.0, max_retry_after=120.0):
+        self.rate = float(rate) if rate is not None else None
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.latency_target = latency_target
+        self.max_retry_after = max_retry_after
+
+        self._tokens = float(burst)
+        self._updated = time.time()
+        self._blocked_until = 0.0
+        self._last_decrease = 0.0
+        self._latency = None
+        self._waiting = 0
+        self._throttled = 0
+        self._window_start = self._updated
+        self._window_requests = 0
+        self._observed_rate = 0.0
+        self._condition = threading.Condition()
+
+    def _refill(self, now):
+        if self.rate is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _count_request(self, now):
+        # the rate requests are sent at, measured in windows of a second
+        if now - self._window_start >= 1.0:
+            self._observed_rate = self._window_requests / (now - self._window_start)
+            self._window_start = now
+            self._window_requests = 0
+        self._window_requests += 1
+
+    def _get_observed_rate(self, now):
+        return max(self._observed_rate, self._window_requests / max(now - self._window_start, 1.0))
+
+    def acquire(self, timeout=None):
+        """
+        This method blocks until the host may be sent the next request. If that takes longer than timeout seconds,
+        RateLimitTimeout is raised.
+        """
+        end = time.time() + timeout if timeout is not None else None
+        with self._condition:
+            self._waiting += 1
+            try:
+                while True:
+                    now = time.time()
+                    self._refill(now)
+                    wait = self._blocked_until - now
+                    if wait <= 0:
+                        if self.rate is None:
+                            self._count_request(now)
+                            return
+                        if self._tokens >= 1:
+                            self._tokens -= 1
+                            return
+                        wait = (1 - self._tokens) / self.rate
+                    if end is not None:
+                        if now + wait > end:
+                            raise RateLimitTimeout(u'no request slot available within %s seconds' % timeout)
+                    self._condition.wait(wait)
+            finally:
+                self._waiting -= 1
+
+    def record(self, status_code, latency, retry_after=None):
+        """
+        This method adapts the rate to the outcome of a request.
+        """
+        with self._condition:
+            now = time.time()
+            self._refill(now)
+            if self._latency is None:
+                self._latency = latency
+            else:
+                self._latency = 0.8 * self._latency + 0.2 * latency
+
+            if status_code in self.THROTTLE_STATUS_CODES:
+                self._throttled += 1
+                # concurrent requests usually get throttled together, so the rate is only lowered once per second
+                if self.rate is None:
+                    self.rate = max(self.min_rate, self._get_observed_rate(now) * self.decrease_factor)
+                    self._last_decrease = now
+                elif now - self._last_decrease >= 1.0:
+                    self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+                    self._last_decrease = now
+                self._tokens = min(self._tokens, 0.0)
+                if retry_after is not None:
+                    self._blocked_until = max(self._blocked_until, now + min(retry_after, self.max_retry_after))
+            elif self.rate is None:
+                pass
+            elif self._latency > self.latency_target:
+                self.rate = max(self.min_rate, self.rate * 0.98)
+            else:
+                # additive increase of about increase_step per second of traffic
+                self.rate += self.increase_step / self.rate
+                if self.max_rate is not None:
+                    self.rate = min(self.max_rate, self.rate)
+            self._condition.notify_all()
+
+    def get_stats(self):
+        with self._condition:
+            return {
+                'rate': self.rate,
+                'queue_depth': self._waiting,
+                'latency': self._latency,
+                'throttled': self._throttled,
+                'blocked_for': max(self._blocked_until - time.time(), 0.0),
+            }
+
+
+class RateLimiter(object):
+    """
+    The HostRateLimiters of all hosts, shared by all threads. Hosts get the default settings given to the constructor
+    unless they are configured otherwise.
+    """
+
+    def __init__(self, **defaults):
+        self.defaults = defaults
+        self._host_settings = {}
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def configure(self, host, **settings):
+        """
+        This method sets the limiter settings of the given host. It has to be called before the first request to it.
+        """
+        with self._lock:
+            self._host_settings[host] = settings
+
+    def get(self, host):
+        with self._lock:
+            limiter = self._limiters.get(host)
+            if limiter is None:
+                settings = dict(self.defaults)
+                settings.update(self._host_settings.get(host, {}))
+                limiter = self._limiters[host] = HostRateLimiter(**settings)
+        return limiter
+
+    def get_stats(self):
+        with self._lock:
+            limiters = self._limiters.items()
+        return dict((host, limiter.get_stats()) for host, limiter in limiters)
+
+
+default_rate_limiter = RateLimiter()
@@ -0,0 +1,90 @@
+import os, pkgutil, importlib, threading, urlparse
+
+
+class ScraperRegistry(object):
+    """
+    Knows all scraper modules and resolves release URLs to the matching Release instance. Scraper modules are found by
+    looking for the attributes every scraper exposes.
+
+    The Release classes are indexed by the host of their module's SCRAPER_URL, so resolving a URL only has to try the
+    precompiled patterns of the scrapers for that host, in order of descending BaseRelease.priority. URLs of hosts that
+    are not indexed are tried against all scrapers.
+    """
+
+    required_attributes = ('READABLE_NAME', 'SCRAPER_URL', 'Release', 'Search')
+
+    def __init__(self, modules=None):
+        if modules is None:
+            modules = self.discover_modules()
+        self.modules = sorted(modules, key=lambda module: -module.Release.priority)
+
+        self._by_host = {}
+        for module in self.modules:
+            host = self.normalize_host(urlparse.urlsplit(module.SCRAPER_URL).netloc)
+            self._by_host.setdefault(host, []).append(self._get_route(module))
+        self._all_routes = [self._get_route(module) for module in self.modules]
+
+    @classmethod
+    def is_scraper_module(cls, module):
+        return all(hasattr(module, attribute) for attribute in cls.required_attributes)
+
+    @classmethod
+    def discover_modules(cls):
+        """
+        This method imports all modules of the scraper package and returns the ones that are scrapers.
+        """
+        package = __name__.rpartition('.')[0]
+        modules = []
+        for loader, name, is_package in pkgutil.iter_modules([os.path.dirname(os.path.abspath(__file__))]):
+            if is_package or name.startswith('_'):
+                continue
+            module = importlib.import_module('%s.%s' % (package, name) if package else name)
+            if cls.is_scraper_module(module):
+                modules.append(module)
+        return modules
+
+    @staticmethod
+    def normalize_host(host):
+        host = host.lower().split(':', 1)[0]
+        if host.startswith('www.'):
+            host = host[4:]
+        return host
+
+    def _get_route(self, module):
+        return module.Release.get_url_pattern().match, module.Release
+
+    def get_module(self, readable_name):
+        for module in self.modules:
+            if module.READABLE_NAME == readable_name:
+                return module
+        return None
+
+    def release_from_url(self, url):
+        """
+        This method returns the Release instance for the given URL or None if no scraper handles it.
+        """
+        host = self.normalize_host(urlparse.urlsplit(url).netloc)
+        for match_url, release_class in self._by_host.get(host, self._all_routes):
+            m = match_url(url)
+            if m:
+                return release_class.release_from_match(m, url)
+        return None
+
+
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+
+def get_default_registry():
+    """
+    This function returns the registry of all scraper modules in this package.
+    """
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None:
+            _default_registry = ScraperRegistry()
+    return _default_registry
+
+
+def release_from_url(url):
+    return get_default_registry().release_from_url(url)
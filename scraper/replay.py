@@ -0,0 +1,86 @@
+import os, json, urlparse
+import requests
+from cache import make_cache_key, hash_cache_key, build_response
+
+
+class FixtureMissingError(requests.RequestException):
+    """There is no recorded response for a request that should be replayed"""
+    pass
+
+
+class ReplayTransport(object):
+    """
+    A transport that sits below RequestMixin._make_request. In record mode every request is sent to the network and
+    its response is written to the fixture directory, in replay mode the recorded responses are returned without
+    touching the network at all.
+
+    Each fixture consists of a JSON file with the request and the response metadata and a file with the raw body,
+    both named after the host and a hash of the method, URL, parameters and post data.
+    """
+
+    MODE_RECORD = 'record'
+    MODE_REPLAY = 'replay'
+
+    def __init__(self, directory, mode=MODE_REPLAY):
+        if mode not in (self.MODE_RECORD, self.MODE_REPLAY):
+            raise ValueError(u'unknown mode: %s' % mode)
+        self.directory = directory
+        self.mode = mode
+
+    def get_fixture_name(self, method, url, params, post_data):
+        host = urlparse.urlsplit(url).netloc.lower()
+        return '%s-%s' % (host, hash_cache_key(make_cache_key(method, url, params, post_data))[:16])
+
+    def _fixture_paths(self, name):
+        path = os.path.join(self.directory, name)
+        return path + '.json', path + '.body'
+
+    def load(self, method, url, params, post_data):
+        """
+        This method returns the recorded response for the given request.
+        """
+        name = self.get_fixture_name(method, url, params, post_data)
+        meta_path, body_path = self._fixture_paths(name)
+        try:
+            with open(meta_path, 'rb') as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                content = f.read()
+        except IOError:
+            raise FixtureMissingError(u'no recorded response %s for %s %s' % (name, method.upper(), url))
+        return build_response(meta['response_url'], meta['status_code'], meta['headers'], content, meta['encoding'])
+
+    def save(self, method, url, params, post_data, response):
+        """
+        This method records the given response for the given request.
+        """
+        name = self.get_fixture_name(method, url, params, post_data)
+        meta_path, body_path = self._fixture_paths(name)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        meta = {
+            'method': method,
+            'url': url,
+            'params': params,
+            'post_data': post_data,
+            'response_url': response.url,
+            'status_code': response.status_code,
+            'headers': dict((header.lower(), value) for header, value in response.headers.items() if header.lower() == 'content-type'),
+            'encoding': response.encoding,
+        }
+        with open(meta_path, 'wb') as f:
+            json.dump(meta, f, indent=4, sort_keys=True)
+            f.write('\n')
+        with open(body_path, 'wb') as f:
+            f.write(response.content or '')
+
+    def request(self, send, method, url, params, headers, post_data, kwargs):
+        """
+        This method either replays the recorded response or calls send with the given arguments and records its
+        result.
+        """
+        if self.mode == self.MODE_REPLAY:
+            return self.load(method, url, params, post_data)
+        response = send(method=method, url=url, params=params, headers=headers, post_data=post_data, kwargs=kwargs)
+        self.save(method, url, params, post_data, response)
+        return response
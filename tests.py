@@ -1,7 +1,37 @@
 # coding=utf-8
 
+import threading, time, tempfile, shutil, os, sys, types, subprocess, StringIO, json
+import requests
 from unittest import TestCase
 from scraper import audiojelly, beatport
+from scraper.base import BaseRelease, BaseSearch, RequestMixin
+from scraper.pool import ConnectionPool
+from scraper.engine import FetchEngine, as_completed
+from scraper.cache import ResponseCache, make_cache_key, build_response
+from scraper.diskcache import DiskCache
+from scraper.datacache import DataCache, DiskDataBackend, MemoryDataBackend
+from scraper.replay import ReplayTransport, FixtureMissingError
+from scraper.registry import ScraperRegistry, get_default_registry
+from scraper.ratelimit import HostRateLimiter, RateLimitTimeout, RateLimiter
+from scraper.hedging import HedgePolicy
+from scraper.federated import FederatedSearch
+from scraper.deadline import Deadline, DeadlineExceeded
+from scraper.metrics import ScraperMetrics
+from scraper import profile, bulk, model
+from scraper.offload import ProcessExtractor
+from scraper.model import CompactRelease, ArtistCredit
+from scraper.htmlutils import compile_selector, parse_subtrees, element_matcher, select
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def setUpModule():
+    # set SCRAPER_FIXTURES=record to refresh the recorded responses from the live sites
+    RequestMixin.transport = ReplayTransport(FIXTURES_DIRECTORY, os.environ.get('SCRAPER_FIXTURES', ReplayTransport.MODE_REPLAY))
+
+
+def tearDownModule():
+    RequestMixin.transport = None
 
 
 class BeatportTest(TestCase):
@@ -59,6 +89,56 @@ class BeatportTest(TestCase):
 
         self.assertEqual(expected, r.data)
 
+    def test_get_fields(self):
+        r = beatport.Release.release_from_url('http://www.beatport.com/release/dj-tunes-compilation/851318')
+        r.get_track_containers = None
+
+        self.assertEqual({'title': u'DJ Tunes Compilation', 'catalog': [u'CMG117']}, r.get_fields(['title', 'catalog', 'style']))
+
+    def test_get_fields_tracklist_only(self):
+        r = beatport.Release.release_from_url('http://www.beatport.com/release/love-spy-love-dies/27944')
+
+        self.assertEqual({1: [('1', [{'type': 'Remixer', 'name': u'Error Error'}], u'Love Spy / Love Dies [Error Error Remix]', u'07:27'),
+                              ('2', [], u'Love Spy / Love Dies', u'07:07'), ('3', [], u'Reply 23', u'06:58')]},
+                         r.get_fields(['discs'])['discs'])
+
+    def test_batch_resolve(self):
+        with FetchEngine(max_workers=2) as engine:
+            releases = beatport.ReleaseBatch.resolve([43577, 27944, 851318], chunk_size=3, engine=engine)
+
+        self.assertEqual([43577, 27944, 851318], [release.id for release in releases])
+        # 851318 is missing from the batch response and is fetched on its own
+        self.assertEqual([True, True, False], [release._prepared for release in releases])
+        for release in releases:
+            self.assertEqual(beatport.Release(release.id).data['discs'], release.data['discs'])
+        self.assertEqual('http://www.beatport.com/release/love-spy-love-dies/27944', releases[1].data['link'])
+
+    def test_batch_resolve_in_engine_worker(self):
+        engine = FetchEngine(max_workers=1, per_host_limit=1)
+        self.addCleanup(engine.shutdown)
+        # the only worker waits for the batches, string ids are the same as int ids
+        future = engine.submit('api.beatport.com', beatport.ReleaseBatch.resolve, ['43577', '27944', '851318'], 3, engine)
+
+        releases = future.result(timeout=5)
+        self.assertEqual([43577, 27944, 851318], [release.id for release in releases])
+        self.assertEqual([True, True, False], [release._prepared for release in releases])
+
+    def test_iter_releases(self):
+        search = beatport.Search(u'love')
+        ids = [release['release'].id for release in search.releases]
+
+        self.assertEqual(ids, [release['release'].id for release in search.iter_releases(page_size=10)])
+
+    def test_iter_releases_stops_early(self):
+        search = beatport.Search(u'love')
+        pages = []
+        get_page = search.get_page
+        search.get_page = lambda page, page_size=None: pages.append(page) or get_page(page, page_size)
+
+        releases = list(search.iter_releases(page_size=10, max_results=12))
+        self.assertEqual(12, len(releases))
+        self.assertEqual([1, 2], pages)
+
     def test_404(self):
         r = beatport.Release.release_from_url('http://www.beatport.com/release/blubb/123')
         try:
@@ -121,6 +201,13 @@ class AudiojellyTest(TestCase):
 
         self.assertEqual(expected, r.data)
 
+    def test_streaming(self):
+        r = audiojelly.Release.release_from_url('http://www.audiojelly.com/releases/where-is-love-love-is-hard-to-find/210428')
+        streamed = audiojelly.Release.release_from_url('http://www.audiojelly.com/releases/where-is-love-love-is-hard-to-find/210428')
+        streamed.streaming = True
+
+        self.assertEqual(r.data, streamed.data)
+
     def test_404(self):
         r = audiojelly.Release.release_from_url('http://www.audiojelly.com/releases/plus-various-i/999999')
         try:
@@ -128,4 +215,931 @@ class AudiojellyTest(TestCase):
             self.assertFalse(True)
         except audiojelly.AudiojellyAPIError as e:
             if not unicode(e).startswith('404 '):
-                raise e
\ No newline at end of file
+                raise e
+
+    def test_search(self):
+        s = audiojelly.Search(u'love')
+
+        self.assertEqual(25, len(s.releases))
+        self.assertEqual(u'AudioFreQ, Carlo Cavalli, Mysto, Alex Faraci \u2013 Love Rhythm', s.releases[0]['name'])
+        self.assertEqual(u'defamation records | Deep House', s.releases[0]['info'])
+        self.assertEqual(900100, s.releases[0]['release'].id)
+
+        streamed = audiojelly.Search(u'love')
+        streamed.streaming = True
+        self.assertEqual([(r['name'], r['info']) for r in s.releases], [(r['name'], r['info']) for r in streamed.releases])
+
+    def test_search_stops_early(self):
+        s = audiojelly.Search(u'love')
+        s.streaming = True
+        s.max_results = 3
+        s.stream_chunk_size = 512
+        chunks = []
+        iter_content_chunks = s._iter_content_chunks
+        s._iter_content_chunks = lambda content: (chunks.append(chunk) or chunk for chunk in iter_content_chunks(content))
+
+        self.assertEqual([900100, 900101, 900102], [r['release'].id for r in s.releases])
+        self.assertTrue(sum(map(len, chunks)) < len(s.get_response().content) / 4)
+
+    def get_unread_response(self, url, status_code, content, events):
+        """
+        This method returns a response with a body that has not been read yet, whose connection records in events when
+        it is closed and released.
+        """
+        class Closable(object):
+            def close(self):
+                events.append('close')
+
+        class Raw(object):
+            def __init__(self):
+                self._fp = Closable()
+                self._connection = Closable()
+                self.body = StringIO.StringIO(content)
+
+            def read(self, amt=None, **kwargs):
+                return self.body.read(amt)
+
+            def release_conn(self):
+                events.append('release')
+
+        response = build_response(url, status_code, {'content-type': 'text/html; charset=utf-8'}, '', 'utf-8')
+        response._content = False
+        response._content_consumed = False
+        response.raw = Raw()
+        return response
+
+    def test_stopped_stream_is_closed(self):
+        s = audiojelly.Search(u'love')
+        events = []
+        response = self.get_unread_response(s.get_url(), 200, s.get_response().content, events)
+
+        s = audiojelly.Search(u'love')
+        s.streaming = True
+        s.max_results = 3
+        s._cached_response = response
+        self.assertEqual(3, len(s.releases))
+        self.assertEqual(['close', 'close', 'release'], events)
+
+    def test_not_found_stream_is_closed(self):
+        s = audiojelly.Search(u'nothing')
+        s.streaming = True
+        events = []
+        s._cached_response = self.get_unread_response(s.get_url(), 500, '<html>error</html>', events)
+        s.raise_exception(u'500')
+
+        self.assertEqual([], s.releases)
+        self.assertEqual(['close', 'close', 'release'], events)
+
+    def test_search_pages(self):
+        releases = list(audiojelly.Search(u'love').iter_releases())
+
+        self.assertEqual(37, len(releases))
+        self.assertEqual(range(900100, 900137), [r['release'].id for r in releases])
+
+
+class ConnectionPoolTest(TestCase):
+
+    def test_session_per_host(self):
+        connection_pool = ConnectionPool()
+        session = connection_pool.get_session('http://api.beatport.com/catalog/releases/detail')
+
+        self.assertIs(session, connection_pool.get_session('http://API.beatport.com/catalog/search'))
+        self.assertIsNot(session, connection_pool.get_session('http://www.audiojelly.com/search/all/'))
+
+
+class FetchEngineTest(TestCase):
+
+    def test_per_host_limit(self):
+        engine = FetchEngine(max_workers=8, per_host_limit=2)
+        self.addCleanup(engine.shutdown)
+        lock = threading.Lock()
+        running = {'now': 0, 'max': 0}
+
+        def fetch(i):
+            with lock:
+                running['now'] += 1
+                running['max'] = max(running['max'], running['now'])
+            time.sleep(0.01)
+            with lock:
+                running['now'] -= 1
+            return i
+
+        futures = engine.map('api.beatport.com', fetch, range(10))
+        results = [future.result() for future in as_completed(futures, timeout=5)]
+
+        self.assertEqual(range(10), sorted(results))
+        self.assertEqual(2, running['max'])
+        # only as many workers as there were calls for
+        self.assertEqual(2, len(engine._workers))
+
+    def test_exception_is_reraised(self):
+        with FetchEngine(max_workers=1) as engine:
+            future = engine.submit('www.audiojelly.com', int, 'not a number')
+
+            self.assertRaises(ValueError, future.result, 5)
+
+    def test_shutdown(self):
+        engine = FetchEngine(max_workers=4)
+        futures = engine.map('www.audiojelly.com', lambda i: time.sleep(0.01) or i, range(6))
+        engine.shutdown()
+
+        self.assertEqual(range(6), [future.result(0) for future in futures])
+        self.assertEqual(4, len(engine._workers))
+        self.assertFalse(any(worker.is_alive() for worker in engine._workers))
+        self.assertRaises(RuntimeError, engine.submit, 'www.audiojelly.com', int, '1')
+
+
+class HydratedSearchTest(TestCase):
+
+    class Release(BaseRelease):
+        url = 'http://www.example.com/release'
+
+        def __init__(self, id):
+            self.id = id
+
+        def __unicode__(self):
+            return u'<TestRelease: id=%d>' % self.id
+
+        def _extract_infos(self):
+            if self.id == 3:
+                raise BaseRelease.exception(u'broken release')
+            return {'title': u'Release %d' % self.id}
+
+    class Search(BaseSearch):
+
+        def __unicode__(self):
+            return u'<TestSearch>'
+
+        def _extract_releases(self):
+            return [{'name': u'Release %d' % i, 'info': None, 'release': HydratedSearchTest.Release(i)} for i in range(6)]
+
+    def test_failed_releases_are_skipped(self):
+        search = self.Search(u'term')
+
+        with FetchEngine(max_workers=4) as engine:
+            releases = list(search.iter_hydrated_releases(max_workers=2, engine=engine))
+
+        self.assertEqual([0, 1, 2, 4, 5], sorted(release['release'].id for release in releases))
+        for release in releases:
+            self.assertEqual({'title': u'Release %d' % release['release'].id}, release['release'].data)
+
+
+class FederatedSearchTest(TestCase):
+
+    class Search(BaseSearch):
+        delay = 0
+        results = []
+
+        def __unicode__(self):
+            return u'<TestSearch>'
+
+        def iter_releases(self, page_size=None, max_results=None, engine=None):
+            for name, catalog in self.results:
+                time.sleep(self.delay)
+                yield {'name': name, 'info': None, 'catalog': catalog, 'release': None}
+
+    def get_module(self, name, results, delay=0):
+        module = type('Module', (object,), {})()
+        module.READABLE_NAME = name
+        module.SCRAPER_URL = 'http://www.%s.com/' % name.lower()
+        module.Release = type('Release', (BaseRelease,), {'url_regex': '^http://www\\.%s\\.com/(\\d+)$' % name.lower()})
+        module.Search = type('Search', (self.Search,), {'results': results, 'delay': delay})
+        return module
+
+    def test_deduplication(self):
+        registry = ScraperRegistry([
+            self.get_module('One', [(u'Artist \u2013 Love', u'CAT-001'), (u'Artist \u2013 Hate', u'CAT-002')]),
+            self.get_module('Two', [(u'artist - love!', None), (u'Artist \u2013 Hate', u'cat002'), (u'Other \u2013 Love', None)], delay=0.01),
+        ])
+        search = FederatedSearch(u'love', registry=registry)
+
+        self.assertEqual([(u'One', u'Artist \u2013 Love'), (u'One', u'Artist \u2013 Hate'), (u'Two', u'Other \u2013 Love')],
+                         [(release['source'], release['name']) for release in search.releases])
+        self.assertEqual([], search.timed_out)
+
+    def test_deadline_keeps_partial_results(self):
+        registry = ScraperRegistry([
+            self.get_module('Fast', [(u'A \u2013 Fast', None)]),
+            self.get_module('Slow', [(u'A \u2013 Slow %d' % i, None) for i in range(10)], delay=0.2),
+        ])
+        search = FederatedSearch(u'love', registry=registry, deadlines={'Slow': 0.5})
+
+        start = time.time()
+        names = [release['name'] for release in search.releases]
+        self.assertTrue(time.time() - start < 1)
+        self.assertEqual([u'A \u2013 Fast', u'A \u2013 Slow 0', u'A \u2013 Slow 1'], sorted(names))
+        self.assertEqual(['Slow'], search.timed_out)
+
+    def test_limits_of_sources(self):
+        calls = []
+
+        class Search(self.Search):
+            def iter_releases(self, page_size=None, max_results=None, engine=None):
+                calls.append((max_results, self.get_deadline()))
+                return iter([])
+
+        module = self.get_module('One', [])
+        module.Search = Search
+        FederatedSearch(u'love', registry=ScraperRegistry([module]), deadline=5).releases
+
+        max_results, deadline = calls[0]
+        self.assertEqual(25, max_results)
+        self.assertTrue(4 < deadline.remaining() <= 5)
+
+
+class ResponseCacheTest(TestCase):
+
+    def test_key_ignores_parameter_order(self):
+        self.assertEqual(make_cache_key('get', 'http://api.beatport.com/catalog/releases/detail', {'id': 43577, 'v': '1.0'}, None),
+                         make_cache_key('get', 'http://api.beatport.com/catalog/releases/detail', {'v': '1.0', 'id': 43577}, None))
+
+    def test_lru_eviction(self):
+        response_cache = ResponseCache(maxsize=2)
+        response_cache.set('a', 1)
+        response_cache.set('b', 2)
+        response_cache.get('a')
+        response_cache.set('c', 3)
+
+        self.assertEqual(1, response_cache.get('a'))
+        self.assertEqual(None, response_cache.get('b'))
+        self.assertEqual({'size': 2, 'hits': 2, 'misses': 1, 'evictions': 1, 'expirations': 0}, response_cache.get_stats())
+
+    def test_ttl(self):
+        response_cache = ResponseCache()
+        response_cache.set('a', 1, ttl=-1)
+        response_cache.set('b', 2, ttl=0)
+
+        self.assertEqual(None, response_cache.get('a'))
+        self.assertEqual(None, response_cache.get('b'))
+        self.assertEqual(1, response_cache.get_stats()['expirations'])
+
+
+class DiskCacheTest(TestCase):
+
+    class Request(RequestMixin):
+        url = 'http://www.audiojelly.com/releases/plus-various-i/230282'
+        response_cache = None
+
+        def __init__(self, responses):
+            self.responses = responses
+            self.sent_headers = []
+
+        def _make_request(self, method, url, params, headers, post_data, kwargs):
+            self.sent_headers.append(headers)
+            return self.responses.pop(0)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_revalidation(self):
+        disk_cache = DiskCache(self.directory, max_age=0)
+        response = build_response(self.Request.url, 200, {'content-type': 'text/html; charset=utf-8', 'etag': '"abc"'}, 'release page', 'utf-8')
+
+        request = self.Request([response])
+        request.disk_cache = disk_cache
+        self.assertEqual(u'release page', request.get_response().text)
+
+        request = self.Request([build_response(self.Request.url, 304, {}, '', None)])
+        request.disk_cache = disk_cache
+        self.assertEqual(u'release page', request.get_response().text)
+        self.assertEqual('"abc"', request.sent_headers[0]['If-None-Match'])
+
+    def test_eviction(self):
+        disk_cache = DiskCache(self.directory, max_size=20)
+        for i in range(3):
+            disk_cache.set(('get', str(i), None, None), build_response(str(i), 200, {}, 'body %d' % i, None))
+            time.sleep(0.01)
+        disk_cache.evict()
+
+        self.assertEqual(None, disk_cache.get(('get', '0', None, None)))
+        self.assertEqual(1, len(os.listdir(os.path.join(self.directory, 'bodies'))))
+
+
+class DataCacheTest(TestCase):
+
+    url = 'http://www.audiojelly.com/releases/plus-various-i/230282'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get_release(self, data_cache):
+        r = get_default_registry().release_from_url(self.url)
+        r.data_cache = data_cache
+        return r
+
+    def test_hit(self):
+        data_cache = DataCache(MemoryDataBackend(maxsize=1))
+        data = self.get_release(data_cache).data
+
+        r = self.get_release(data_cache)
+        self.assertEqual(data, r.data)
+        self.assertEqual(None, r._cached_response)
+        self.assertFalse(r.data is data)
+        self.assertEqual(1, data_cache.get_stats()['hits'])
+
+    def test_version(self):
+        data_cache = DataCache()
+        self.get_release(data_cache).data
+
+        r = self.get_release(data_cache)
+        r.scraper_version = 'changed'
+        r.data
+        self.assertTrue(r._prepared)
+        self.assertEqual(1, data_cache.get_stats()['invalidations'])
+        # the other scrapers' entries are not affected
+        self.assertEqual(audiojelly.Release(1, 'x').get_scraper_version(), self.get_release(None).get_scraper_version())
+        self.assertNotEqual(beatport.Release(1, 'x').get_scraper_version(), self.get_release(None).get_scraper_version())
+
+    def test_version_ignores_other_modules(self):
+        # only the declared modules count, not whatever else of the package happens to be imported
+        self.assertEqual(('scraper.base', 'scraper.htmlutils', 'scraper.model', 'scraper.audiojelly'),
+                         audiojelly.Release(1, 'x').get_extraction_modules())
+        self.assertFalse('scraper.bulk' in beatport.Release(1, 'x').get_extraction_modules())
+
+    def test_version_of_unreadable_module(self):
+        module = types.ModuleType('scraper.unreadable')
+        sys.modules[module.__name__] = module
+        try:
+            Release = type('Release', (audiojelly.Release,), {
+                '__module__': module.__name__,
+                'extraction_modules': audiojelly.Release.extraction_modules + (module.__name__,),
+            })
+            r = Release(230282, 'plus-various-i')
+            r.data_cache = DataCache()
+
+            self.assertEqual(None, r.get_scraper_version())
+            self.assertEqual(None, r.get_data_cache())
+        finally:
+            del sys.modules[module.__name__]
+
+    def test_revalidation(self):
+        data_cache = DataCache(DiskDataBackend(self.directory), max_age=0)
+        data = self.get_release(data_cache).data
+
+        r = self.get_release(data_cache)
+        self.assertEqual(data, r.data)
+        self.assertFalse(r._prepared)
+        self.assertEqual(1, data_cache.get_stats()['revalidations'])
+
+        # the body changed
+        r = self.get_release(data_cache)
+        data_cache.set(r.get_data_cache_key(), r.get_scraper_version(), {'title': u'old'}, 'other')
+        self.assertEqual(data, r.data)
+        self.assertTrue(r._prepared)
+
+
+class ReplayTransportTest(TestCase):
+
+    def test_missing_fixture(self):
+        transport = ReplayTransport(FIXTURES_DIRECTORY)
+
+        self.assertRaises(FixtureMissingError, transport.load, 'get', 'http://www.audiojelly.com/releases/unknown/1', None, None)
+
+
+class ScraperRegistryTest(TestCase):
+
+    def test_discover_modules(self):
+        registry = ScraperRegistry()
+
+        self.assertEqual(['Audiojelly', 'Beatport'], sorted(module.READABLE_NAME for module in registry.modules))
+
+    def test_release_from_url(self):
+        registry = ScraperRegistry()
+
+        r = registry.release_from_url('http://beatport.com/release/love-love-love-yeah/43577')
+        self.assertIsInstance(r, beatport.Release)
+        self.assertEqual(43577, r.id)
+        self.assertEqual('http://beatport.com/release/love-love-love-yeah/43577', r.release_url)
+
+        r = registry.release_from_url('http://www.audiojelly.com/releases/plus-various-i/230282')
+        self.assertIsInstance(r, audiojelly.Release)
+        self.assertEqual(230282, r.id)
+
+        self.assertEqual(None, registry.release_from_url('http://www.beatport.com/track/love-love-love-yeah/198001'))
+        self.assertEqual(None, registry.release_from_url('http://www.example.com/release/love-love-love-yeah/43577'))
+
+
+class HtmlUtilsTest(TestCase):
+
+    def test_selectors_are_compiled_once(self):
+        self.assertIs(compile_selector('div.trackListRow'), compile_selector('div.trackListRow'))
+
+    def test_parse_subtrees(self):
+        html = '<html><body><ul><li><label>Artist</label> <span class="spec">Rework</span></li>' \
+               '<li><label>Label</label><b>-</b><span class="spec">Playhouse</span></li></ul>' \
+               '<div class="trackList release"><div class="trackListRow">1</div></div>' + '<p>footer</p>' * 100 + '</body></html>'
+        chunks = [html[i:i + 10] for i in range(0, len(html), 10)]
+        consumed = []
+
+        def feed():
+            for chunk in chunks:
+                consumed.append(chunk)
+                yield chunk
+
+        document = parse_subtrees(feed(), element_matcher('label', 'span.spec', 'div.trackList.release'), element_matcher('div.trackList.release'))
+
+        self.assertEqual(['Rework'], [span.text for span in select(document, 'label + span.spec')])
+        self.assertEqual(1, len(select(document, 'div.trackListRow')))
+        self.assertTrue(len(consumed) < len(chunks))
+
+
+class CompactReleaseTest(TestCase):
+
+    def test_round_trip(self):
+        for url in ('http://www.beatport.com/release/dj-tunes-compilation/851318',
+                    'http://www.audiojelly.com/releases/where-is-love-love-is-hard-to-find/210428'):
+            data = get_default_registry().release_from_url(url).data
+            self.assertEqual(data, CompactRelease.from_data(data).to_data())
+
+    def test_shared_artist_credits(self):
+        r = beatport.Release.release_from_url('http://www.beatport.com/release/dj-tunes-compilation/851318')
+        compact = r.get_compact_data()
+        tracks = compact.discs[0].tracks
+
+        self.assertIs(tracks[3].artists[0], CompactRelease.from_data(r.data).discs[0].tracks[3].artists[0])
+        self.assertIs(ArtistCredit.get(u'Alex Faraci', 'Main'), tracks[3].artists[0])
+        self.assertFalse(hasattr(compact, '__dict__'))
+
+    def test_tables_are_bounded(self):
+        credit = ArtistCredit.get(u'Nobody Refers To Me', 'Main')
+        key = (str, 'Main', unicode, u'Nobody Refers To Me')
+        self.assertTrue(key in ArtistCredit._instances)
+        del credit
+        self.assertFalse(key in ArtistCredit._instances)
+
+        for i in range(model.MAX_INTERNED + 1):
+            model.intern_string(u'string %d' % i)
+        self.assertTrue(len(model._interned) <= model.MAX_INTERNED)
+
+
+class RateLimiterTest(TestCase):
+
+    def test_throttling_halves_rate(self):
+        limiter = HostRateLimiter(rate=8, burst=1)
+        limiter.record(200, 0.1)
+        rate = limiter.rate
+        limiter.record(429, 0.1)
+        limiter.record(503, 0.1)
+
+        self.assertTrue(rate > 8)
+        self.assertEqual(rate / 2, limiter.rate)
+        self.assertEqual(2, limiter.get_stats()['throttled'])
+
+    def test_unlimited_until_throttled(self):
+        limiter = HostRateLimiter()
+        start = time.time()
+        for i in range(50):
+            limiter.acquire(timeout=0)
+            limiter.record(200, 0.01)
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertEqual(None, limiter.rate)
+
+        limiter.record(429, 0.01)
+        self.assertEqual(25, limiter.rate)
+        self.assertRaises(RateLimitTimeout, limiter.acquire, 0)
+
+    def test_retry_after(self):
+        limiter = HostRateLimiter(rate=100, burst=10)
+        limiter.acquire(timeout=0)
+        limiter.record(429, 0.1, retry_after=5)
+
+        self.assertRaises(RateLimitTimeout, limiter.acquire, 0.05)
+        self.assertTrue(4 < limiter.get_stats()['blocked_for'] <= 5)
+
+    def test_host_settings(self):
+        rate_limiter = RateLimiter(rate=5)
+        rate_limiter.configure('api.beatport.com', rate=20)
+
+        self.assertEqual(20, rate_limiter.get('api.beatport.com').rate)
+        self.assertEqual(5, rate_limiter.get('www.audiojelly.com').rate)
+        self.assertEqual(['api.beatport.com', 'www.audiojelly.com'], sorted(rate_limiter.get_stats()))
+
+
+class HedgePolicyTest(TestCase):
+
+    class FakeResponse(object):
+        def __init__(self, status_code):
+            self.status_code = status_code
+
+    def test_hedge_wins(self):
+        policy = HedgePolicy(min_samples=5, min_hedge_delay=0.01)
+        for i in range(5):
+            policy.get_latency('example.com').record(0.01)
+        calls = []
+
+        def send():
+            calls.append(None)
+            if len(calls) == 1:
+                time.sleep(0.5)
+                return self.FakeResponse(502)
+            return self.FakeResponse(200)
+
+        self.assertEqual(200, policy.send(send, 'example.com').status_code)
+        stats = policy.get_stats()['example.com']
+        self.assertEqual(1, stats['hedges'])
+        self.assertEqual(1, stats['hedge_wins'])
+        self.assertEqual(0, stats['retries'])
+
+    def test_loser_is_closed(self):
+        policy = HedgePolicy(min_samples=5, min_hedge_delay=0.01)
+        for i in range(5):
+            policy.get_latency('example.com').record(0.01)
+        released = threading.Event()
+
+        class Raw(object):
+            def release_conn(self):
+                released.set()
+
+        slow = self.FakeResponse(200)
+        slow._content_consumed = True
+        slow.raw = Raw()
+        responses = [slow, self.FakeResponse(200)]
+
+        def send():
+            response = responses.pop(0)
+            if response is slow:
+                time.sleep(0.1)
+            return response
+
+        self.assertFalse(policy.send(send, 'example.com') is slow)
+        self.assertTrue(released.wait(1))
+
+    def test_no_hedge_without_samples(self):
+        policy = HedgePolicy(min_samples=5)
+        self.assertEqual(None, policy.get_hedge_delay('example.com'))
+
+        self.assertEqual(200, policy.send(lambda: self.FakeResponse(200), 'example.com').status_code)
+        self.assertEqual(0, policy.get_stats()['example.com']['hedges'])
+
+    def test_retries(self):
+        policy = HedgePolicy(retries=2, backoff=0.001)
+        outcomes = [requests.ConnectionError(u'reset'), self.FakeResponse(504), self.FakeResponse(200)]
+
+        def send():
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        self.assertEqual(200, policy.send(send, 'example.com').status_code)
+        self.assertEqual(2, policy.get_stats()['example.com']['retries'])
+
+    def test_every_attempt_is_paced(self):
+        policy = HedgePolicy(hedge_percentile=50, min_samples=5, min_hedge_delay=0.01, retries=1, backoff=0.001)
+        for i in range(5):
+            policy.get_latency('example.com').record(0.01)
+        paced = []
+
+        def pace(blocking=True):
+            paced.append(blocking)
+            # no slot for hedges
+            return blocking
+
+        def send():
+            time.sleep(0.1)
+            return self.FakeResponse(502)
+
+        self.assertEqual(502, policy.send(send, 'example.com', pace=pace).status_code)
+        # the first request and its retry, each with a hedge that got no slot
+        self.assertEqual([True, False, True, False], paced)
+        self.assertEqual(0, policy.get_stats()['example.com']['hedges'])
+
+    def test_retry_delay_ends_at_deadline(self):
+        policy = HedgePolicy(retries=5, backoff=10)
+
+        def send():
+            raise requests.ConnectionError(u'reset')
+
+        start = time.time()
+        self.assertRaises(DeadlineExceeded, policy.send, send, 'example.com', Deadline(0.1))
+        self.assertTrue(time.time() - start < 0.5)
+
+    def test_retries_are_bounded(self):
+        policy = HedgePolicy(retries=1, backoff=0.001)
+
+        def send():
+            raise requests.Timeout(u'timed out')
+
+        self.assertRaises(requests.Timeout, policy.send, send, 'example.com')
+        stats = policy.get_stats()['example.com']
+        self.assertEqual(1, stats['retries'])
+        self.assertEqual(1, stats['failures'])
+
+
+class DeadlineTest(TestCase):
+
+    def test_expired_before_fetch(self):
+        r = beatport.Release(27944)
+
+        self.assertEqual({'partial': True}, r.get_data(Deadline(0)))
+        self.assertEqual(None, r._cached_response)
+        # the deadline only applied to the call
+        self.assertEqual(None, r.get_deadline())
+        self.assertEqual(u'Love Spy / Love Dies', r.data['title'])
+
+    def test_metadata_without_tracklist(self):
+        r = beatport.Release(27944)
+        get_track_length = r.get_track_length
+
+        def slow_get_track_length(trackContainer):
+            time.sleep(0.1)
+            return get_track_length(trackContainer)
+        r.get_track_length = slow_get_track_length
+
+        data = r.get_data(Deadline(0.15))
+        self.assertTrue(data['partial'])
+        self.assertEqual(u'Love Spy / Love Dies', data['title'])
+        self.assertFalse('discs' in data)
+
+        # the missing fields are extracted with a new deadline
+        data = r.get_data(Deadline(10))
+        self.assertFalse('partial' in data)
+        self.assertEqual(3, len(data['discs'][1]))
+
+    def test_request_timeout(self):
+        request = RequestMixin()
+        request.deadline = Deadline(0)
+
+        self.assertRaises(DeadlineExceeded, request._send, RequestMixin.REQUEST_METHOD_GET, 'http://www.example.com/', None, {}, None, {})
+
+    def test_timeout_of_deadline(self):
+        class Session(object):
+            def get(self, **kwargs):
+                raise requests.Timeout(u'timed out after %s seconds' % kwargs['timeout'])
+
+        class Pool(object):
+            def get_session(self, url):
+                return Session()
+
+        request = RequestMixin()
+        request.connection_pool = Pool()
+        request.hedge_policy = None
+        request.deadline = Deadline(10)
+
+        self.assertRaises(DeadlineExceeded, request._send, RequestMixin.REQUEST_METHOD_GET, 'http://www.example.com/', None, {}, None, {'timeout': 30})
+        self.assertRaises(requests.Timeout, request._send, RequestMixin.REQUEST_METHOD_GET, 'http://www.example.com/', None, {}, None, {'timeout': 5})
+
+    def test_partial_search(self):
+        s = beatport.Search(u'love')
+        s.get_release_name = lambda releaseContainer: time.sleep(0.02)
+
+        releases = s.get_releases(Deadline(0.1))
+        self.assertTrue(s.partial)
+        self.assertTrue(0 < len(releases) < 25)
+
+
+class InstrumentationTest(TestCase):
+
+    class Sink(object):
+        def __init__(self):
+            self.spans = []
+
+        def record_span(self, name, seconds, tags):
+            self.spans.append((name, tags))
+
+    def test_release_spans(self):
+        sink = self.Sink()
+        r = beatport.Release(27944)
+        r.instrument = True
+        r.span_sink = sink
+        r.data
+
+        names = [name for name, tags in sink.spans]
+        self.assertEqual(['fetch', 'decode', 'prepare', 'get_release_date'], names[:4])
+        self.assertTrue('get_styles' in names)
+        for name, tags in sink.spans:
+            self.assertEqual('beatport', tags['scraper'])
+            self.assertEqual(27944, tags['release'])
+        self.assertEqual(3, dict((name, tags) for name, tags in sink.spans)['get_track_artists']['count'])
+
+    def test_search_spans(self):
+        sink = self.Sink()
+        s = audiojelly.Search(u'love')
+        s.instrument = True
+        s.span_sink = sink
+        s.releases
+
+        spans = dict(sink.spans)
+        self.assertEqual(25, spans['get_release_name']['count'])
+        self.assertEqual(u'love', spans['fetch']['search_term'])
+
+    def test_disabled(self):
+        r = beatport.Release(27944)
+        r.record_span = None
+
+        self.assertEqual(None, r.get_span_sink())
+        self.assertTrue(r.data['discs'])
+
+
+class MetricsTest(TestCase):
+
+    def test_release_metrics(self):
+        metrics = ScraperMetrics()
+        r = beatport.Release(27944)
+        r.metrics = metrics
+        r.response_cache = None
+        r.data
+        missing = beatport.Release(123)
+        missing.metrics = metrics
+        self.assertRaises(beatport.BeatportAPIError, lambda: missing.data)
+
+        self.assertEqual(1, metrics.requests.get(('beatport', 'release', '200')))
+        self.assertEqual(1, metrics.requests.get(('beatport', 'release', '404')))
+        self.assertEqual(1, metrics.parse_duration.get_count(('beatport', 'release')))
+        self.assertTrue(metrics.response_bytes.get(('beatport', 'release')) > 1000)
+        self.assertEqual(1, metrics.exceptions.get(('beatport', 'release', 'BeatportAPIError')))
+
+    def test_not_found(self):
+        metrics = ScraperMetrics()
+        s = audiojelly.Search(u'nothing')
+        s.metrics = metrics
+        s.raise_exception(u'500')
+
+        self.assertEqual(1, metrics.not_found.get(('audiojelly', 'search')))
+
+    def test_prometheus_format(self):
+        metrics = ScraperMetrics()
+        metrics.record_request('beatport', 'search', 200, 0.3, 512)
+        metrics.add_stats_collector('test_cache', u'Test cache.', lambda: {'hits': 3, 'size': 2, 'name': 'ignored'})
+        text = metrics.registry.to_prometheus()
+
+        self.assertTrue(u'# TYPE scraper_requests_total counter\nscraper_requests_total{scraper="beatport",operation="search",status="200"} 1\n' in text)
+        self.assertTrue(u'scraper_request_duration_seconds_bucket{scraper="beatport",operation="search",le="0.25"} 0\n' in text)
+        self.assertTrue(u'scraper_request_duration_seconds_bucket{scraper="beatport",operation="search",le="0.5"} 1\n' in text)
+        self.assertTrue(u'scraper_request_duration_seconds_bucket{scraper="beatport",operation="search",le="+Inf"} 1\n' in text)
+        self.assertTrue(u'scraper_request_duration_seconds_count{scraper="beatport",operation="search"} 1\n' in text)
+        self.assertTrue(u'scraper_response_bytes_total{scraper="beatport",operation="search"} 512\n' in text)
+        self.assertTrue(u'# TYPE test_cache_hits_total counter\ntest_cache_hits_total 3\n' in text)
+        self.assertTrue(u'# TYPE test_cache_size gauge\ntest_cache_size 2\n' in text)
+
+
+class ProfileTest(TestCase):
+
+    def test_release(self):
+        out = StringIO.StringIO()
+        directory = tempfile.mkdtemp()
+        try:
+            flamegraph = os.path.join(directory, 'stacks.txt')
+            profile.main(['http://www.audiojelly.com/releases/plus-various-i/230282', '--repeat', '50', '--flamegraph', flamegraph], out)
+
+            self.assertTrue(os.path.exists(flamegraph))
+        finally:
+            shutil.rmtree(directory)
+        report = out.getvalue()
+        self.assertTrue('get_track_artists' in report)
+        self.assertTrue("select('div.trackListRow')" in report)
+
+    def test_search(self):
+        out = StringIO.StringIO()
+        profile.main(['--search', 'love', '--scraper', 'beatport', '--repeat', '2'], out)
+
+        self.assertTrue(out.getvalue().startswith('Beatport search "love"'))
+        self.assertTrue('get_release_name' in out.getvalue())
+
+
+class BulkTest(TestCase):
+
+    URLS = [
+        'http://www.beatport.com/release/love-spy-love-dies/27944',
+        '# comment',
+        'http://www.example.com/release/1',
+        '',
+        'http://www.beatport.com/release/blubb/123',
+        'http://www.audiojelly.com/releases/love-infinity-love-to-the-square-root-of-infinity/211079',
+    ]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.input = os.path.join(self.directory, 'urls.txt')
+        with open(self.input, 'w') as f:
+            f.write('\n'.join(self.URLS) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_bulk(self, *args):
+        out, err = StringIO.StringIO(), StringIO.StringIO()
+        exit_code = bulk.main([self.input, '--workers', '2'] + list(args), stdout=out, stderr=err)
+        return exit_code, [json.loads(line) for line in out.getvalue().splitlines()], err.getvalue()
+
+    def test_results(self):
+        exit_code, results, summary = self.run_bulk()
+
+        self.assertEqual(1, exit_code)
+        results = dict((result['index'], result) for result in results)
+        self.assertEqual([0, 1, 2, 3], sorted(results))
+        self.assertTrue(results[0]['ok'])
+        self.assertEqual(u'Love Spy / Love Dies', results[0]['data']['title'])
+        self.assertEqual('UnsupportedURL', results[1]['error']['type'])
+        self.assertEqual('BeatportAPIError', results[2]['error']['type'])
+        self.assertTrue(results[3]['ok'])
+        self.assertTrue(summary.startswith('2 resolved, 2 failed, 0 skipped'))
+
+    def test_checkpoint(self):
+        checkpoint = os.path.join(self.directory, 'checkpoint')
+        with open(checkpoint, 'w') as f:
+            f.write('0\n2\n')
+
+        exit_code, results, summary = self.run_bulk('--checkpoint', checkpoint)
+        self.assertEqual([1, 3], sorted(result['index'] for result in results))
+        self.assertTrue(summary.startswith('1 resolved, 1 failed, 2 skipped'))
+
+        exit_code, results, summary = self.run_bulk('--checkpoint', checkpoint)
+        self.assertEqual([], results)
+        self.assertEqual(0, exit_code)
+
+    def test_search(self):
+        with open(self.input, 'w') as f:
+            f.write('love\n')
+        exit_code, results, summary = self.run_bulk('--search', '--max-results', '5')
+
+        self.assertEqual(0, exit_code)
+        self.assertEqual(10, len(results[0]['releases']))
+        self.assertEqual(set(['Beatport', 'Audiojelly']), set(release['source'] for release in results[0]['releases']))
+
+    def test_close(self):
+        registry = get_default_registry()
+        matched = []
+        class CountingRegistry(object):
+            def release_from_url(self, url):
+                matched.append(url)
+                return registry.release_from_url(url)
+
+        resolver = bulk.BulkResolver(registry=CountingRegistry(), workers=2)
+        results = list(resolver.iter_results([(0, self.URLS[0]), (1, self.URLS[2])]))
+        self.assertEqual([True, False], [result['ok'] for result in sorted(results, key=lambda result: result['index'])])
+        self.assertEqual([self.URLS[0], self.URLS[2]], matched)
+
+        resolver.close()
+        self.assertFalse(any(worker.is_alive() for worker in resolver.engine._workers))
+        self.assertRaises(RuntimeError, resolver.engine.submit, 'host', lambda: None)
+
+
+class ProcessExtractorTest(TestCase):
+
+    # run in a fresh process, since the pool must be created before any threads are started
+    SCRIPT = """
+import json, sys
+from scraper import audiojelly
+from scraper.base import RequestMixin
+from scraper.cache import build_response
+from scraper.datacache import DataCache
+from scraper.metrics import ScraperMetrics
+from scraper.offload import ProcessExtractor
+from scraper.registry import get_default_registry
+from scraper.replay import ReplayTransport
+
+extractor = ProcessExtractor(2)
+RequestMixin.transport = ReplayTransport(sys.argv[1])
+results = {}
+for url in sys.argv[2:]:
+    r = get_default_registry().release_from_url(url)
+    data = extractor.extract(r)
+    results[url] = {'data': data, 'memoized': r.data is data}
+
+# settings of the instance are not sent to the pool
+r = get_default_registry().release_from_url(sys.argv[2])
+r.data_cache = DataCache()
+r.metrics = ScraperMetrics()
+results['configured'] = extractor.extract(r) == results[sys.argv[2]]['data']
+
+r = audiojelly.Release(211079, 'love-infinity-love-to-the-square-root-of-infinity')
+r.get_response()
+r._cached_response = build_response(r._cached_response.url, 200, {}, '<html><body></body></html>', 'utf-8')
+try:
+    extractor.extract(r)
+except Exception as e:
+    results['exception'] = e.__class__.__name__
+extractor.close()
+json.dump(results, sys.stdout)
+"""
+
+    def test_extract(self):
+        urls = ['http://www.beatport.com/release/dj-tunes-compilation/851318',
+                'http://www.audiojelly.com/releases/plus-various-i/230282']
+        output = subprocess.check_output([sys.executable, '-c', self.SCRIPT, FIXTURES_DIRECTORY] + urls,
+                                         cwd=os.path.dirname(os.path.abspath(__file__)))
+        results = json.loads(output)
+
+        for url in urls:
+            expected = json.loads(json.dumps(get_default_registry().release_from_url(url).data))
+            self.assertEqual(expected, results[url]['data'])
+            self.assertTrue(results[url]['memoized'])
+        self.assertEqual('AudiojellyAPIError', results['exception'])
+        self.assertTrue(results['configured'])
+
+    def test_refuses_running_threads(self):
+        stop = threading.Event()
+        thread = threading.Thread(target=stop.wait)
+        thread.start()
+        try:
+            self.assertRaises(RuntimeError, ProcessExtractor, 1)
+        finally:
+            stop.set()
+            thread.join()